@@ -0,0 +1,292 @@
+#!/usr/local/cs/bin/python3
+import argparse
+import json
+import os
+import platform
+import random
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = '1K,10K,100K,1M'
+SIZE_SUFFIXES = {'': 1, 'K': 10 ** 3, 'M': 10 ** 6}
+# Argument lists longer than this are skipped for the -e mode
+ECHO_MAX_LINES = 10000
+# Count used for the -n mode
+HEAD_COUNT = 1000
+LONG_LINE_LENGTH = 200
+# Runs the command in argv[2:] as its child and writes "status maxrss wall"
+# to the file descriptor in argv[1]. ru_maxrss counts the memory of the
+# process that exec'd the command, so measuring from this small process
+# keeps the harness's own memory out of the results.
+LAUNCHER = '''
+import os, signal, sys, time
+fd = int(sys.argv[1])
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    os.close(fd)
+    # Python ignores SIGPIPE, and exec would pass that on
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    try:
+        os.execvp(sys.argv[2], sys.argv[2:])
+    finally:
+        os._exit(127)
+_, status, usage = os.wait4(pid, 0)
+wall = time.perf_counter() - start
+os.write(fd, f'{os.waitstatus_to_exitcode(status)} {usage.ru_maxrss} '
+             f'{wall!r}'.encode())
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark shuf.py across modes and input sizes.',
+        usage='%(prog)s [OPTION]...\n'
+              '  or:  %(prog)s --compare OLD.json NEW.json\n'
+              '\n'
+              'Options:\n'
+              '      --sizes=LIST        comma-separated line counts '
+              '(default: ' + DEFAULT_SIZES + ')\n'
+              '      --modes=LIST        only run these modes\n'
+              '      --shuf=PATH         shuf.py to benchmark\n'
+              '      --python=PATH       interpreter used to run shuf.py\n'
+              '      --data-dir=DIR      keep generated inputs in DIR\n'
+              '      --timeout=SECONDS   give up on a single run after SECONDS\n'
+              '      --no-gnu            do not compare against GNU shuf\n'
+              '  -o, --output=FILE       write the results as JSON to FILE\n'
+              '      --compare OLD NEW   compare two JSON result files\n'
+              '      --help              display this help and exit\n'
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='comma-separated line counts, e.g. 1K,1M,100M')
+    parser.add_argument('--modes', help='only run these modes')
+    parser.add_argument('--shuf', default=os.path.join(here, 'shuf.py'),
+                        help='shuf.py to benchmark')
+    parser.add_argument('--python', default=sys.executable,
+                        help='interpreter used to run shuf.py')
+    parser.add_argument('--data-dir', help='keep generated inputs in DIR')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='give up on a single run after SECONDS')
+    parser.add_argument('--no-gnu', action='store_true',
+                        help='do not compare against GNU shuf')
+    parser.add_argument('-o', '--output', help='write the results to FILE')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files')
+
+    args = parser.parse_args()
+    try:
+        args.sizes = [parse_count(size) for size in args.sizes.split(',')]
+    except ValueError:
+        parser.error(f"invalid size list: '{args.sizes}'")
+    if args.modes is not None:
+        args.modes = args.modes.split(',')
+        unknown = [mode for mode in args.modes if mode not in MODES]
+        if unknown:
+            parser.error(f"unknown mode: '{unknown[0]}' "
+                         f"(choose from {', '.join(MODES)})")
+    return args
+
+def parse_count(count_str):
+    # Parse a line count with an optional K/M suffix, e.g. 100M
+    count_str = count_str.strip().upper()
+    unit = count_str[-1:] if count_str[-1:].isalpha() else ''
+    number = count_str[:-1] if unit else count_str
+    if unit not in SIZE_SUFFIXES:
+        raise ValueError(count_str)
+    count = int(number) * SIZE_SUFFIXES[unit]
+    if count <= 0:
+        raise ValueError(count_str)
+    return count
+
+def generate_input(path, count, kind):
+    # Write count synthetic lines: short numeric IDs or long text lines
+    rng = random.Random(count)
+    with open(path, 'wb') as f:
+        batch = []
+        for i in range(count):
+            if kind == 'short':
+                batch.append(b'%d\n' % rng.getrandbits(40))
+            else:
+                batch.append(b'%08d ' % i
+                             + rng.randbytes(LONG_LINE_LENGTH // 2).hex()
+                             .encode()[:LONG_LINE_LENGTH - 10] + b'\n')
+            if len(batch) >= 65536:
+                f.write(b''.join(batch))
+                batch.clear()
+        f.write(b''.join(batch))
+
+def input_path(data_dir, count, kind):
+    path = os.path.join(data_dir, f'{kind}-{count}.txt')
+    if not os.path.exists(path):
+        generate_input(path, count, kind)
+    return path
+
+# Each mode maps (input path, line count) to (shuf arguments, stdin path,
+# number of output lines to read before stopping the run)
+MODES = {
+    'echo': lambda path, count: (['-e'] + read_lines(path), None, None),
+    'range': lambda path, count: (['-i', f'1-{count}'], None, None),
+    'file': lambda path, count: ([path], None, None),
+    'stdin': lambda path, count: ([], path, None),
+    'head': lambda path, count: (['-n', str(HEAD_COUNT), path], None, None),
+    'repeat': lambda path, count: (['-r', path], None, count),
+    'repeat-head': lambda path, count: (['-r', '-n', str(count), path],
+                                        None, None),
+}
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f]
+
+def run(cmd, stdin_path, limit, timeout):
+    # Run one benchmark command through LAUNCHER; return wall time, output
+    # lines and peak RSS in bytes, or None if it timed out or failed
+    stdin = open(stdin_path, 'rb') if stdin_path else subprocess.DEVNULL
+    report, report_w = os.pipe()
+    deadline = time.perf_counter() + timeout
+    # A session of its own lets a timeout kill the command with LAUNCHER
+    proc = subprocess.Popen([sys.executable, '-S', '-c', LAUNCHER,
+                             str(report_w)] + cmd,
+                            stdin=stdin, stdout=subprocess.PIPE,
+                            pass_fds=(report_w,), start_new_session=True)
+    os.close(report_w)
+    lines = 0
+    timed_out = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not selector.select(remaining):
+                timed_out = True
+                break
+            chunk = os.read(proc.stdout.fileno(), 1 << 16)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            if limit is not None and lines >= limit:
+                lines = limit
+                break
+    # A run stopped at limit ends on the closed pipe, as under head
+    proc.stdout.close()
+    if not timed_out:
+        try:
+            proc.wait(max(0, deadline - time.perf_counter()))
+        except subprocess.TimeoutExpired:
+            timed_out = True
+    if timed_out:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    with os.fdopen(report, 'rb') as f:
+        fields = f.read().split()
+    if stdin_path:
+        stdin.close()
+    if timed_out or len(fields) != 3:
+        return None
+    status, maxrss, wall = int(fields[0]), int(fields[1]), float(fields[2])
+    if limit is None and status != 0:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return wall, lines, maxrss * scale
+
+def benchmark(args, data_dir):
+    gnu = None if args.no_gnu else shutil.which('shuf')
+    tools = [('shuf.py', [args.python, args.shuf])]
+    if gnu:
+        tools.append(('gnu', [gnu]))
+    modes = args.modes or list(MODES)
+    # No run can report less than what LAUNCHER itself holds when it forks
+    floor = run(['true'], None, None, args.timeout)
+    if floor is not None:
+        floor = floor[2]
+        print(f'peak RSS includes a launcher floor of '
+              f'{floor / (1 << 20):.1f} MiB', flush=True)
+    results = []
+    for count in args.sizes:
+        for kind in ('short', 'long'):
+            path = input_path(data_dir, count, kind)
+            for mode in modes:
+                if mode == 'echo' and count > ECHO_MAX_LINES:
+                    continue
+                if mode == 'range' and kind == 'long':
+                    # -i doesn't read the input, so one run is enough
+                    continue
+                shuf_args, stdin_path, limit = MODES[mode](path, count)
+                for tool, prefix in tools:
+                    measured = run(prefix + shuf_args, stdin_path, limit,
+                                   args.timeout)
+                    result = {'mode': mode, 'size': count, 'kind': kind,
+                              'tool': tool}
+                    if measured is None:
+                        result.update(wall=None, lines=None,
+                                      lines_per_sec=None, peak_rss=None)
+                    else:
+                        wall, lines, peak_rss = measured
+                        result.update(wall=wall, lines=lines,
+                                      lines_per_sec=lines / wall,
+                                      peak_rss=peak_rss)
+                    results.append(result)
+                    print_result(result)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'shuf': os.path.abspath(args.shuf),
+        'gnu': gnu,
+        'rss_floor': floor,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def print_result(result):
+    name = f"{result['tool']:8} {result['mode']:12} " \
+           f"{result['kind']:5} {result['size']:>10}"
+    if result['wall'] is None:
+        print(f'{name}  failed or timed out', flush=True)
+    else:
+        print(f"{name}  {result['wall']:9.3f}s "
+              f"{result['lines_per_sec']:14,.0f} lines/s "
+              f"{result['peak_rss'] / (1 << 20):9.1f} MiB", flush=True)
+
+def compare(old_path, new_path):
+    # Print the wall-time ratio of every run present in both files
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(result):
+        return result['tool'], result['mode'], result['kind'], result['size']
+
+    old_results = {key(result): result for result in old['results']}
+    for result in new['results']:
+        before = old_results.get(key(result))
+        if before is None or before['wall'] is None or result['wall'] is None:
+            continue
+        tool, mode, kind, size = key(result)
+        print(f'{tool:8} {mode:12} {kind:5} {size:>10}  '
+              f"{before['wall']:9.3f}s -> {result['wall']:9.3f}s  "
+              f"x{before['wall'] / result['wall']:6.2f} speed  "
+              f"x{result['peak_rss'] / before['peak_rss']:6.2f} memory")
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+        report = benchmark(args, args.data_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='bench_shuf.') as data_dir:
+            report = benchmark(args, data_dir)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1870 @@
+import os
+import sys
+import random
+import mmap
+import stat
+import time
+from array import array
+from itertools import chain
+
+# Ranges up to this size are shuffled as an index array (4 bytes a number,
+# so 64 MiB at most), which is several times faster than permuting them
+# lazily; larger ones are permuted lazily so memory doesn't depend on the
+# size of the range
+RANGE_SHUFFLE_LIMIT = 1 << 24
+# Up to this many -n picks from a range are drawn into a set by Floyd's
+# algorithm; more are taken as a prefix of a permutation
+RANGE_SAMPLE_LIMIT = 1 << 20
+MASK64 = (1 << 64) - 1
+# Upper bound on bucket files open at once in the external shuffle
+MAX_BUCKETS = 256
+# Lines of multi-file input are keyed by (file number << OFFSET_BITS) | offset
+OFFSET_BITS = 48
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+MAX_FILES = 1 << (64 - OFFSET_BITS)
+# Compressed input is recognized by its first bytes; see detect_compression()
+COMPRESSION_HEADER = 10
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+# Sidecar line index written next to FILE by --index-cache
+SIDECAR_SUFFIX = '.shufidx'
+SIDECAR_MAGIC = b'SHUFIX2' + sys.byteorder[0].upper().encode()
+# Average line length from which -o writes mapped lines with writev;
+# shorter lines cost more in writev calls than gathering them saves
+WRITEV_MIN_LINE = 512
+# Longest request line a --serve process accepts; a client sends its whole
+# standard input in one
+MAX_REQUEST = 1 << 32
+SIZE_SUFFIXES = {'': 1, 'B': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30,
+                 'T': 1 << 40}
+
+def parse_args():
+    # Imported here so importing shuf as a library doesn't pay for it
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Shuffle input lines and write to standard output.',
+        usage='%(prog)s [OPTION]... [FILE]...\n'
+              '  or:  %(prog)s [OPTION]... --echo "args list"\n'
+              '\n'
+              'Options:\n'
+              '  -e, --echo              treat each ARG as an input line\n'
+              '  -i, --input-range LO-HI specify an input range (e.g., 1-5)\n'
+              '  -n, --head-count=COUNT output at most COUNT lines\n'
+              '  -r, --repeat            allow output lines to be repeated\n'
+              '      --weights=FILE      weight each input line by the number\n'
+              '                            on the same line of FILE\n'
+              '      --weight-field=N    weight each input line by its field N\n'
+              '      --group-key=N       keep lines with equal field N together\n'
+              '                            and shuffle the groups; -n counts groups\n'
+              '      --stratify=N        with -n COUNT, sample COUNT lines for\n'
+              '                            each value of field N\n'
+              '  -t, --field-separator=SEP split fields at SEP, not whitespace\n'
+              '      --random-source=FILE get random bytes from FILE\n'
+              '      --seed=N            seed the random generator with N\n'
+              '      --window=K          stream through a K-line shuffle buffer\n'
+              '      --index-cache       keep line offsets in FILE.shufidx\n'
+              '  -o, --output=FILE       write result to FILE instead of standard output\n'
+              '      --buffer-size=SIZE  write output in chunks of SIZE bytes\n'
+              '  -z, --compress=METHOD   compress the output with gzip, bz2 or xz\n'
+              '      --shards=N          deal the output round-robin into N files\n'
+              '      --output-prefix=PATH name the shard files PATH00, PATH01, ...\n'
+              '      --engine=ENGINE     shuffle with ENGINE: python or numpy\n'
+              '  -S, --memory-limit=SIZE shuffle input larger than SIZE on disk\n'
+              '  -T, --temp-dir=DIR      use DIR for temporary bucket files\n'
+              '      --stats             report timing and memory to stderr\n'
+              '      --profile=FILE      write cProfile data for the run to FILE\n'
+              '      --serve=SOCKET      serve shuffle requests on a Unix socket\n'
+              '      --connect=SOCKET    send this shuffle to a --serve process\n'
+              '      --cache-size=N      keep N file indexes cached when serving\n'
+              '      --help              display this help and exit\n'
+    )
+    parser.add_argument('-e', '--echo', nargs='+',
+                        help='treat each ARG as an input line')
+    parser.add_argument('-i', '--input-range',
+                        help='treat each number LO through HI as an input line')
+    parser.add_argument('-n', '--head-count', type=int,
+                        help='output at most COUNT lines')
+    parser.add_argument('-r', '--repeat', action='store_true',
+                        help='output lines can be repeated')
+    parser.add_argument('--weights', metavar='FILE',
+                        help='weight each input line by the number on the '
+                             'same line of FILE')
+    parser.add_argument('--weight-field', type=int, metavar='N',
+                        help='weight each input line by its field N')
+    parser.add_argument('--group-key', type=int, metavar='N',
+                        help='keep lines with the same field N together '
+                             'and shuffle the groups')
+    parser.add_argument('--stratify', type=int, metavar='N',
+                        help='with -n COUNT, sample COUNT lines for each '
+                             'value of field N')
+    parser.add_argument('-t', '--field-separator', metavar='SEP',
+                        help='split fields at SEP instead of whitespace')
+    parser.add_argument('--random-source', metavar='FILE',
+                        help='get random bytes from FILE')
+    parser.add_argument('--seed', type=int,
+                        help='seed the random generator with N')
+    parser.add_argument('--window', type=int, metavar='K',
+                        help='stream through a K-line shuffle buffer')
+    parser.add_argument('--index-cache', action='store_true',
+                        help='keep line offsets in a FILE.shufidx sidecar')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write result to FILE instead of standard output')
+    parser.add_argument('--buffer-size', type=int, default=65536,
+                        help='write output in chunks of SIZE bytes')
+    parser.add_argument('-z', '--compress', metavar='METHOD',
+                        choices=list(COMPRESSION_SUFFIXES),
+                        help='compress the output with gzip, bz2 or xz')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help='deal the output round-robin into N files')
+    parser.add_argument('--output-prefix', metavar='PATH',
+                        help='name the shard files PATH00, PATH01, ...')
+    parser.add_argument('--engine', choices=['python', 'numpy'],
+                        default='python',
+                        help='shuffle with ENGINE: python or numpy')
+    parser.add_argument('-S', '--memory-limit',
+                        help='shuffle input larger than SIZE on disk')
+    parser.add_argument('-T', '--temp-dir',
+                        help='use DIR for temporary bucket files')
+    # SHUF_STATS and SHUF_PROFILE turn these on without changing the
+    # command; SHUF_STATS=0 (or false, no, off) leaves stats off
+    parser.add_argument('--stats', action='store_true',
+                        default=os.environ.get('SHUF_STATS', '').lower()
+                        not in ('', '0', 'false', 'no', 'off'),
+                        help='report timing and memory to stderr')
+    parser.add_argument('--profile', metavar='FILE',
+                        default=os.environ.get('SHUF_PROFILE') or None,
+                        help='write cProfile data for the run to FILE')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='serve shuffle requests on a Unix socket')
+    parser.add_argument('--connect', metavar='SOCKET',
+                        help='send this shuffle to a --serve process')
+    parser.add_argument('--cache-size', type=int, default=8,
+                        help='keep N file indexes cached when serving')
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help='input files (default: standard input)')
+    
+    args = parser.parse_args()
+    
+    # Validate mutual exclusivity of --echo and --input-range
+    if args.echo and args.input_range:
+        parser.error("options --echo and --input-range are mutually exclusive")
+    if not args.files:
+        args.files = ['-']
+    if len(args.files) > MAX_FILES:
+        parser.error(f"too many input files (at most {MAX_FILES})")
+    if args.weights and args.weight_field is not None:
+        parser.error("options --weights and --weight-field are mutually "
+                     "exclusive")
+    if (args.weights or args.weight_field is not None) and args.input_range:
+        parser.error("weighted sampling does not apply to --input-range")
+    if args.weight_field is not None and args.weight_field <= 0:
+        parser.error(f"invalid field number: '{args.weight_field}'")
+    if args.group_key is not None or args.stratify is not None:
+        if args.group_key is not None and args.stratify is not None:
+            parser.error("options --group-key and --stratify are mutually "
+                         "exclusive")
+        field = args.group_key if args.stratify is None else args.stratify
+        if field <= 0:
+            parser.error(f"invalid field number: '{field}'")
+        if args.input_range or args.repeat or args.window is not None:
+            parser.error("grouping does not apply to --input-range, "
+                         "--repeat or --window")
+        if args.weights or args.weight_field is not None:
+            parser.error("grouping does not apply to weighted sampling")
+        if args.stratify is not None and args.head_count is None:
+            parser.error("--stratify requires --head-count")
+    if args.field_separator is not None:
+        if not args.field_separator:
+            parser.error("the field separator must not be empty")
+        args.field_separator = os.fsencode(args.field_separator)
+    if args.seed is not None and args.random_source is not None:
+        parser.error("options --seed and --random-source are mutually exclusive")
+    if args.buffer_size <= 0:
+        parser.error(f"invalid buffer size: '{args.buffer_size}'")
+    if args.shards is not None:
+        if args.shards <= 0:
+            parser.error(f"invalid number of shards: '{args.shards}'")
+        if not args.output_prefix:
+            parser.error("--shards requires --output-prefix")
+        if args.repeat and args.head_count is None:
+            parser.error("--shards needs --head-count with --repeat")
+        if args.connect:
+            parser.error("options --shards and --connect are mutually "
+                         "exclusive")
+        if args.output:
+            parser.error("options --shards and --output are mutually "
+                         "exclusive")
+    elif args.output_prefix:
+        parser.error("--output-prefix requires --shards")
+    if args.window is not None:
+        if args.window <= 0:
+            parser.error(f"invalid window size: '{args.window}'")
+        if args.input_range or args.repeat:
+            parser.error("--window does not apply to --input-range or "
+                         "--repeat")
+        if args.weights or args.weight_field is not None:
+            parser.error("--window does not apply to weighted sampling")
+    if args.serve and args.output:
+        parser.error("options --serve and --output are mutually exclusive")
+    if args.serve and args.connect:
+        parser.error("options --serve and --connect are mutually exclusive")
+    if args.connect:
+        # The server shuffles with its own settings for these, so refuse
+        # them rather than drop them
+        server_side = (('--window', args.window is not None),
+                       ('--random-source', args.random_source is not None),
+                       ('--memory-limit', args.memory_limit is not None),
+                       ('--temp-dir', args.temp_dir is not None),
+                       ('--engine', args.engine != 'python'),
+                       ('--index-cache', args.index_cache))
+        for option, given in server_side:
+            if given:
+                parser.error(f"options {option} and --connect are mutually "
+                             "exclusive")
+    if args.cache_size < 0:
+        parser.error(f"invalid cache size: '{args.cache_size}'")
+    if args.memory_limit is not None:
+        try:
+            args.memory_limit = parse_size(args.memory_limit)
+        except ValueError:
+            parser.error(f"invalid memory limit: '{args.memory_limit}'")
+    
+    return args
+
+def parse_size(size_str):
+    # Parse a byte count with an optional K/M/G/T suffix, e.g. 512M
+    size_str = size_str.strip().upper()
+    unit = size_str[-1:] if size_str[-1:].isalpha() else ''
+    number = size_str[:-1] if unit else size_str
+    if unit not in SIZE_SUFFIXES:
+        raise ValueError(size_str)
+    size = int(number) * SIZE_SUFFIXES[unit]
+    if size <= 0:
+        raise ValueError(size_str)
+    return size
+
+class FileRandom(random.Random):
+    # Random generator that takes its bits from a file, like GNU
+    # shuf --random-source
+
+    def __init__(self, path):
+        try:
+            self.source = open(path, 'rb')
+        except IOError as e:
+            sys.stderr.write(f"shuf: {path}: {e.strerror}\n")
+            sys.exit(1)
+        self.path = path
+        super().__init__()
+
+    def getrandbits(self, k):
+        if k == 0:
+            return 0
+        nbytes = (k + 7) // 8
+        data = self.source.read(nbytes)
+        if len(data) < nbytes:
+            sys.stderr.write(f"shuf: {self.path}: end of file\n")
+            sys.exit(1)
+        return int.from_bytes(data, 'big') >> (nbytes * 8 - k)
+
+    def random(self):
+        return self.getrandbits(53) * (2.0 ** -53)
+
+def make_rng(args):
+    # Every shuffle draws from this object instead of the global random
+    # module state
+    if args.random_source is not None:
+        return FileRandom(args.random_source)
+    return random.Random(args.seed)
+
+def substream(base, index):
+    # Independent generator for chunk index of a shuffle seeded with base;
+    # seeding from bytes runs them through SHA-512
+    return random.Random(b'%d:%d' % (base, index))
+
+def read_input(args):
+    # All input lines, packed into one LineArena
+    if args.echo:
+        return LineArena(os.fsencode(arg) + b'\n' for arg in args.echo)
+    return LineArena(iter_input(args))
+
+def parse_range(range_str):
+    if '-' not in range_str:
+        sys.stderr.write(f"shuf: invalid input range: '{range_str}'\n")
+        sys.exit(1)
+    lo, hi = range_str.split('-', 1)
+    try:
+        lo = int(lo)
+        hi = int(hi)
+    except ValueError:
+        sys.stderr.write(f"shuf: invalid input range: '{range_str}'\n")
+        sys.exit(1)
+    if lo > hi:
+        sys.stderr.write(f"shuf: invalid input range: '{range_str}'\n")
+        sys.exit(1)
+    return lo, hi
+
+def floyd_sample(n, k, rng):
+    # Floyd's algorithm: k distinct integers from range(n) using O(k) memory
+    picks = set()
+    for j in range(n - k, n):
+        t = rng.randrange(j + 1)
+        picks.add(j if t in picks else t)
+    return picks
+
+def permuted_range(n, rng):
+    # Stream a pseudo-random permutation of range(n) in constant memory: a
+    # Feistel network over x = hi * b + lo (hi < a, lo < b) is a bijection
+    # on range(a * b), and cycle walking maps it back onto range(n). Each
+    # round adds a keyed hash of one digit to the other and swaps them, so
+    # the radixes alternate. With a = ceil(sqrt(n)) and a * b the first
+    # multiple of a from n, fewer than a numbers are walked past, where a
+    # power-of-two domain can be almost 2n.
+    from math import isqrt
+    a = isqrt(n - 1) + 1 if n > 1 else 1
+    b = -(-n // a)
+    k0, k1, k2, k3 = (rng.getrandbits(64) for _ in range(4))
+    m = 0x9E3779B97F4A7C15
+    for i in range(n):
+        x = i
+        while True:
+            hi, lo = divmod(x, b)
+            f = (lo ^ k0) * m & MASK64
+            x = lo * a + (hi + (f ^ f >> 29)) % a
+            hi, lo = divmod(x, a)
+            f = (lo ^ k1) * m & MASK64
+            x = lo * b + (hi + (f ^ f >> 29)) % b
+            hi, lo = divmod(x, b)
+            f = (lo ^ k2) * m & MASK64
+            x = lo * a + (hi + (f ^ f >> 29)) % a
+            hi, lo = divmod(x, a)
+            f = (lo ^ k3) * m & MASK64
+            x = lo * b + (hi + (f ^ f >> 29)) % b
+            if x < n:
+                break
+        yield x
+
+def range_values(lo, hi, repeat, head_count, rng):
+    # Shuffle the integers lo..hi without materializing the range
+    n = hi - lo + 1
+    if repeat:
+        if head_count is None:
+            while True:
+                yield lo + rng.randrange(n)
+        for _ in range(head_count):
+            yield lo + rng.randrange(n)
+    elif (head_count is not None and head_count < n // 2
+            and head_count <= RANGE_SAMPLE_LIMIT):
+        # Few picks from a larger range: Floyd's algorithm holds only them
+        picks = list(floyd_sample(n, max(0, head_count), rng))
+        rng.shuffle(picks)
+        for x in picks:
+            yield lo + x
+    else:
+        # The whole range, or too many picks to hold: take a prefix of a
+        # full permutation, whose memory doesn't depend on COUNT
+        count = n if head_count is None else max(0, min(head_count, n))
+        if n <= RANGE_SHUFFLE_LIMIT:
+            order = line_order(n)
+            rng.shuffle(order)
+            for x in order[:count]:
+                yield lo + x
+        else:
+            from itertools import islice
+            for x in islice(permuted_range(n, rng), count):
+                yield lo + x
+
+def range_lines(lo, hi, repeat, head_count, rng):
+    # Generate --input-range output lines
+    for x in range_values(lo, hi, repeat, head_count, rng):
+        yield b'%d\n' % x
+
+def iter_input(args):
+    # Yield lines from each file (or standard input) in turn, as bytes
+    # ending in a newline
+    for path in args.files:
+        yield from iter_file(path)
+
+def iter_file(path):
+    # gzip, bz2 and xz input is decompressed on the fly
+    if path == '-':
+        try:
+            stdin = sys.stdin.buffer
+            method = detect_compression(stdin.peek(COMPRESSION_HEADER))
+            if method:
+                yield from decompressed_lines(stdin, method, 'standard input')
+                return
+            for line in stdin:
+                yield line if line.endswith(b'\n') else line + b'\n'
+        except Exception as e:
+            sys.stderr.write(f"shuf: error reading standard input: {e}\n")
+            sys.exit(1)
+    else:
+        try:
+            with open(path, 'rb') as f:
+                method = detect_compression(f.peek(COMPRESSION_HEADER))
+                if method:
+                    yield from decompressed_lines(f, method, path)
+                    return
+                for line in f:
+                    yield line if line.endswith(b'\n') else line + b'\n'
+        except IOError as e:
+            sys.stderr.write(f"shuf: cannot open '{path}': {e.strerror}\n")
+            sys.exit(1)
+
+def detect_compression(head):
+    # Check the fixed part of each header past the magic number, so text
+    # that merely starts with one (say 'BZhang') is still read as text.
+    # gzip: magic, deflate method and flags with the reserved bits clear.
+    # bz2: magic, block size 1-9 and the magic of a block or of the end of
+    # the stream. xz: magic, zero flags byte and a known check type.
+    if head[:3] == b'\x1f\x8b\x08' and head[3:4] and not head[3] & 0xe0:
+        return 'gzip'
+    if (head[:3] == b'BZh' and b'1' <= head[3:4] <= b'9'
+            and head[4:10] in (b'1AY&SY', b'\x17rE8P\x90')):
+        return 'bz2'
+    if (head[:7] == b'\xfd7zXZ\x00\x00'
+            and head[7:8] in (b'\x00', b'\x01', b'\x04', b'\x0a')):
+        return 'xz'
+    return None
+
+def open_decompressed(f, method):
+    if method == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=f)
+    if method == 'bz2':
+        import bz2
+        return bz2.BZ2File(f)
+    import lzma
+    return lzma.LZMAFile(f)
+
+def new_compressor(method):
+    if method == 'gzip':
+        import zlib
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if method == 'bz2':
+        import bz2
+        return bz2.BZ2Compressor()
+    import lzma
+    return lzma.LZMACompressor()
+
+def decompressed_lines(f, method, name):
+    # Decompress in a background thread that hands blocks to this one
+    # through a bounded queue, so decompression (which releases the GIL)
+    # overlaps with splitting lines and shuffling. If the consumer stops
+    # early, stop tells the thread to quit instead of blocking on a full
+    # queue with f still open.
+    import io
+    import queue
+    import threading
+    blocks = queue.Queue(maxsize=8)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decompress():
+        source = RecordingReader(f)
+        try:
+            with open_decompressed(source, method) as z:
+                for block in iter(lambda: z.read(1 << 20), b''):
+                    source.forget()
+                    if not put(block):
+                        return
+            put(None)
+            return
+        except Exception as e:
+            if source.record is None:
+                put(e)
+                return
+        # The first block failed to decompress, so the header was a
+        # coincidence: pass the input through as text instead
+        try:
+            raw = iter(lambda: f.read(1 << 20), b'')
+            for block in chain(source.record, raw):
+                if not put(block):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decompress, daemon=True)
+    thread.start()
+    try:
+        pending = b''
+        for block in iter(blocks.get, None):
+            if isinstance(block, Exception):
+                sys.stderr.write(f"shuf: {name}: {block}\n")
+                sys.exit(1)
+            end = block.rfind(b'\n') + 1
+            if not end:
+                pending += block
+                continue
+            yield from io.BytesIO(pending + block[:end])
+            pending = block[end:]
+        if pending:
+            yield pending + b'\n'
+    finally:
+        # Wait for the thread, so f isn't closed under it
+        stop.set()
+        thread.join()
+
+class RecordingReader:
+    # Reads through to f, keeping what was read until forget() is called,
+    # so input that turns out not to decompress can be read again as text
+
+    def __init__(self, f):
+        self.f = f
+        self.record = []
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if self.record is not None:
+            self.record.append(data)
+        return data
+
+    def forget(self):
+        self.record = None
+
+def open_mapping(path):
+    # Map a regular file read-only and return the mapping and the stat of
+    # the descriptor it was mapped from, taken after mapping so the file
+    # is known to be no older than the mapping. The mapping is b'' for an
+    # empty file, and None if it isn't a regular file (pipe, terminal,
+    # ...) so the caller can fall back to reading lines.
+    if path == '-':
+        return None, None
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                return None, st
+            if st.st_size == 0:
+                return b'', st
+            if detect_compression(f.peek(COMPRESSION_HEADER)):
+                return None, st
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return mm, os.fstat(f.fileno())
+    except IOError as e:
+        sys.stderr.write(f"shuf: cannot open '{path}': {e.strerror}\n")
+        sys.exit(1)
+
+def index_file(path, sidecar=False, number=0):
+    # Worker for the indexing pool: map the file on this side and return
+    # only its offset array, already keyed with the file number
+    mm, st = open_mapping(path)
+    offsets = file_index(path, mm, st, sidecar)
+    if mm:
+        mm.close()
+    return number_offsets(offsets, number)
+
+def number_offsets(offsets, number):
+    # Put number in the top bits of every offset in place. Offsets are
+    # below 1 << OFFSET_BITS, so this only fills the high bytes of each
+    # item, which strided slice assignment does without a Python loop.
+    if number:
+        key = (number << OFFSET_BITS).to_bytes(offsets.itemsize,
+                                                sys.byteorder)
+        with memoryview(offsets) as items, items.cast('B') as raw:
+            for i, byte in enumerate(key):
+                if byte:
+                    raw[i::offsets.itemsize] = bytes([byte]) * len(offsets)
+    return offsets
+
+def file_index(path, mm, st, sidecar):
+    if sidecar and mm:
+        return sidecar_index(path, mm, st)
+    return index_lines(mm)
+
+def map_files(paths, sidecar=False):
+    # Map every input file and build one index over all of them, so lines
+    # are never decoded into str objects. Several files are indexed in
+    # parallel worker processes. Returns None unless every input is a
+    # regular file.
+    maps, file_stats = zip(*map(open_mapping, paths))
+    if any(mm is None for mm in maps):
+        return None
+    maps = list(maps)
+    if len(paths) == 1:
+        return maps, file_index(paths[0], maps[0], file_stats[0], sidecar)
+    from concurrent.futures import ProcessPoolExecutor
+    workers = min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        indexes = list(pool.map(index_file, paths, [sidecar] * len(paths),
+                                range(len(paths))))
+    keys = indexes[0]
+    for offsets in indexes[1:]:
+        keys.extend(offsets)
+    return maps, keys
+
+def index_lines(mm, pos=0):
+    # Scan once for the start offset of every line from pos on
+    offsets = array('Q')
+    find = mm.find
+    size = len(mm)
+    while pos < size:
+        offsets.append(pos)
+        nl = find(b'\n', pos)
+        if nl < 0:
+            break
+        pos = nl + 1
+    return offsets
+
+def sidecar_header():
+    import struct
+    # magic, device, inode, size, mtime_ns, CRC of the indexed bytes,
+    # line count
+    return struct.Struct('<8sQQQqQQ')
+
+def prefix_crc(mm, size):
+    # CRC of the first size bytes, read in place; zlib runs at about
+    # memory speed, far faster than the scan it lets an append skip
+    import zlib
+    with memoryview(mm) as view, view[:size] as prefix:
+        return zlib.crc32(prefix)
+
+def sidecar_index(path, mm, st):
+    # Reuse the line offsets stored in path's sidecar if it still describes
+    # the file (same device, inode, size and mtime). If the file has only
+    # grown and every indexed byte is unchanged, index just the appended
+    # lines. Otherwise scan the whole file and rewrite the sidecar. st is
+    # the stat of the mapped descriptor; the size that counts is that of
+    # mm, which an append after mapping leaves behind st.st_size.
+    length = len(mm)
+    header = sidecar_header()
+    offsets = None
+    indexed = 0
+    try:
+        with open(path + SIDECAR_SUFFIX, 'rb') as f:
+            fields = header.unpack(f.read(header.size))
+            magic, device, inode, size, mtime, crc, count = fields
+            if (magic == SIDECAR_MAGIC and device == st.st_dev
+                    and inode == st.st_ino):
+                if size == length and mtime == st.st_mtime_ns:
+                    indexed = size
+                elif size < length and crc == prefix_crc(mm, size):
+                    indexed = size
+                if indexed:
+                    offsets = array('Q')
+                    offsets.fromfile(f, count)
+    except (OSError, EOFError, ValueError):
+        # Missing, unreadable or truncated sidecar: rebuild it
+        offsets = None
+    if offsets is not None and indexed == length:
+        return offsets
+
+    if offsets is None:
+        offsets = index_lines(mm)
+    else:
+        # Appended to: rescan from the last indexed line, since it may
+        # not have been complete
+        start = indexed
+        if offsets and mm[indexed - 1:indexed] != b'\n':
+            start = offsets.pop()
+        offsets.extend(index_lines(mm, start))
+    write_sidecar(path, st, mm, offsets)
+    return offsets
+
+def write_sidecar(path, st, mm, offsets):
+    # Write to a temporary name and rename, so readers never see half an
+    # index. A file in a read-only directory just goes without a sidecar.
+    header = sidecar_header()
+    sidecar = path + SIDECAR_SUFFIX
+    temp = f'{sidecar}.{os.getpid()}'
+    try:
+        with open(temp, 'wb') as f:
+            f.write(header.pack(SIDECAR_MAGIC, st.st_dev, st.st_ino,
+                                len(mm), st.st_mtime_ns,
+                                prefix_crc(mm, len(mm)), len(offsets)))
+            offsets.tofile(f)
+        os.replace(temp, sidecar)
+    except OSError:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def mapped_line(maps, key):
+    # Return the bytes of the line named by key, newline included
+    mm = maps[key >> OFFSET_BITS]
+    start = key & OFFSET_MASK
+    end = mm.find(b'\n', start)
+    if end < 0:
+        return mm[start:] + b'\n'
+    return mm[start:end + 1]
+
+class LineArena:
+    # Lines packed end to end in one buffer, line i being
+    # data[offsets[i]:offsets[i + 1]]. This costs the line bytes plus 4
+    # bytes a line (8 past 4 GiB of data), where a list of bytes objects
+    # costs about 50 bytes of overhead a line. Supports len(), indexing
+    # and iteration, which is all the shuffles need.
+
+    def __init__(self, lines=()):
+        self.data = bytearray()
+        self.offsets = array('I', [0])
+        # Lines are read through a memoryview, which has to be let go of
+        # before the buffer can grow again
+        self.view = None
+        self.extend(lines)
+
+    @classmethod
+    def from_bytes(cls, data):
+        # Index a block of whole lines, e.g. a temporary bucket file, in
+        # place without splitting it into line objects
+        arena = cls()
+        arena.data = data
+        arena.offsets = index_lines(data)
+        arena.offsets.append(len(data))
+        return arena
+
+    def extend(self, lines):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+        data = self.data
+        offsets = self.offsets
+        for line in lines:
+            data += line
+            try:
+                offsets.append(len(data))
+            except OverflowError:
+                offsets = self.offsets = array('Q', offsets)
+                offsets.append(len(data))
+
+    def append(self, line):
+        self.extend((line,))
+
+    def lines_view(self):
+        if self.view is None:
+            self.view = memoryview(self.data)
+        return self.view
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+        return self.lines_view()[offsets[i]:offsets[i + 1]].tobytes()
+
+    def __iter__(self):
+        view = self.lines_view()
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield view[offsets[i]:offsets[i + 1]].tobytes()
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+def line_order(n):
+    # Index array 0..n-1 for shuffling in place, 4 bytes an entry if the
+    # indexes fit
+    return array('I' if n <= 0xFFFFFFFF else 'Q', range(n))
+
+def mapped_view(maps, views, key):
+    # Like mapped_line, but a memoryview of the line in its mapping, so
+    # the line bytes aren't copied
+    fileno = key >> OFFSET_BITS
+    start = key & OFFSET_MASK
+    end = maps[fileno].find(b'\n', start)
+    if end < 0:
+        return maps[fileno][start:] + b'\n'
+    return views[fileno][start:end + 1]
+
+def window_shuffle(lines, window, rng):
+    # Shuffle buffer: once window lines are held, each new line replaces a
+    # random held line, which is output at once; the rest are shuffled at
+    # EOF. Memory is bounded by window and output starts immediately, but
+    # a line can only move about window places earlier than its input
+    # position, so the order is not uniformly random.
+    held = []
+    for line in lines:
+        if len(held) < window:
+            held.append(line)
+        else:
+            i = rng.randrange(window)
+            yield held[i]
+            held[i] = line
+    rng.shuffle(held)
+    yield from held
+
+def reservoir_sample(lines, head_count, rng):
+    # Algorithm R: keep a uniform sample of head_count lines in one pass,
+    # holding only the sample in memory
+    reservoir = []
+    if head_count <= 0:
+        return reservoir
+    for i, line in enumerate(lines):
+        if i < head_count:
+            reservoir.append(line)
+        else:
+            j = rng.randint(0, i)
+            if j < head_count:
+                reservoir[j] = line
+    # Slots are filled in input order, so shuffle to get a random order
+    rng.shuffle(reservoir)
+    return reservoir
+
+def repeat_choices(population, head_count, rng):
+    # Draw with replacement in batches rather than one call per line
+    batch = 8192
+    if head_count is None:
+        while True:
+            yield from rng.choices(population, k=batch)
+    while head_count > 0:
+        yield from rng.choices(population, k=min(batch, head_count))
+        head_count -= batch
+
+def shuffle_lines(lines, repeat, head_count, rng):
+    if not lines:
+        return
+
+    if repeat:
+        yield from repeat_choices(lines, head_count, rng)
+    else:
+        # Permute an index array in place rather than a copy of the lines
+        order = line_order(len(lines))
+        rng.shuffle(order)
+        if head_count is not None:
+            del order[max(0, head_count):]
+        for i in order:
+            yield lines[i]
+
+def shuffle_offsets(maps, keys, repeat, head_count, rng, views=False):
+    # With views, lines are yielded as memoryviews of the mappings
+    if not keys:
+        return
+
+    if views:
+        from functools import partial
+        line = partial(mapped_view, maps, [memoryview(mm) for mm in maps])
+    else:
+        line = lambda key: mapped_line(maps, key)
+    if repeat:
+        for key in repeat_choices(keys, head_count, rng):
+            yield line(key)
+    elif head_count is not None and head_count < len(keys):
+        # Only the first head_count places need drawing, so a partial
+        # Fisher-Yates shuffle costs O(COUNT) on a cached index
+        n = len(keys)
+        for i in range(max(0, head_count)):
+            j = rng.randrange(i, n)
+            keys[i], keys[j] = keys[j], keys[i]
+        for key in keys[:max(0, head_count)]:
+            yield line(key)
+    else:
+        # Permute the offset index in place instead of a list of lines
+        rng.shuffle(keys)
+        for key in keys:
+            yield line(key)
+
+def external_shuffle(lines, memory_limit, temp_dir, rng, size_hint=None):
+    # Out-of-core shuffle: scatter every line to one of k bucket files
+    # chosen uniformly at random, then shuffle each bucket in memory and
+    # concatenate them. Random buckets plus a uniform shuffle of each
+    # bucket gives a uniform permutation of the whole input.
+    lines = iter(lines)
+    held = LineArena()
+    for line in lines:
+        held.append(line)
+        if held.nbytes > memory_limit:
+            break
+    else:
+        # Everything fit under the limit, so no temporary files are needed
+        yield from shuffle_lines(held, False, None, rng)
+        return
+
+    if size_hint is None:
+        k = 64
+    else:
+        k = max(2, min(MAX_BUCKETS, 2 * size_hint // memory_limit + 1))
+    import tempfile
+    with tempfile.TemporaryDirectory(prefix='shuf.', dir=temp_dir) as tmp:
+        paths = [os.path.join(tmp, str(i)) for i in range(k)]
+        sizes = [0] * k
+        counts = [0] * k
+        files = [open(path, 'wb') for path in paths]
+        try:
+            writes = [f.write for f in files]
+            for line in chain(held, lines):
+                b = rng.randrange(k)
+                writes[b](line)
+                sizes[b] += len(line)
+                counts[b] += 1
+        finally:
+            for f in files:
+                f.close()
+        del held
+
+        # Each bucket gets its own substream, so its shuffle doesn't depend
+        # on the order (or the worker) the buckets are processed in
+        base = rng.getrandbits(64)
+        for i, (path, size, count) in enumerate(zip(paths, sizes, counts)):
+            bucket_rng = substream(base, i)
+            with open(path, 'rb') as f:
+                if count > 1 and size > memory_limit:
+                    # An unlucky bucket is still too big: split it again
+                    yield from external_shuffle(f, memory_limit, tmp,
+                                                bucket_rng, size)
+                else:
+                    bucket = LineArena.from_bytes(f.read())
+                    yield from shuffle_lines(bucket, False, None, bucket_rng)
+            os.remove(path)
+
+def parse_weight(text, lineno):
+    try:
+        weight = float(text)
+    except ValueError:
+        weight = -1.0
+    # Also rejects NaN, which fails every comparison
+    if not 0.0 <= weight < float('inf'):
+        sys.stderr.write(f"shuf: line {lineno}: invalid weight: "
+                         f"'{os.fsdecode(text.strip())}'\n")
+        sys.exit(1)
+    return weight
+
+def line_field(line, lineno, field, separator):
+    # Field number field (from 1) of line, split at separator or whitespace
+    fields = line.split(separator)
+    if separator is not None:
+        fields[-1] = fields[-1].rstrip(b'\n')
+    if field > len(fields):
+        sys.stderr.write(f"shuf: line {lineno}: missing field {field}\n")
+        sys.exit(1)
+    return fields[field - 1]
+
+def field_weights(lines, field, separator):
+    # Yield (weight, line) with the weight taken from a field of the line
+    for lineno, line in enumerate(lines, 1):
+        yield parse_weight(line_field(line, lineno, field, separator),
+                           lineno), line
+
+def file_weights(lines, path):
+    # Yield (weight, line) with weights read line by line from path
+    weights = iter_file(path)
+    lineno = 0
+    for lineno, line in enumerate(lines, 1):
+        text = next(weights, None)
+        if text is None:
+            sys.stderr.write(f"shuf: {path}: fewer weights than input "
+                             f"lines\n")
+            sys.exit(1)
+        yield parse_weight(text, lineno), line
+    if next(weights, None) is not None:
+        sys.stderr.write(f"shuf: {path}: more weights than input lines\n")
+        sys.exit(1)
+
+def alias_table(weights):
+    # Vose's alias method: after O(n) setup, index i is drawn with
+    # probability weights[i] / sum(weights) using one random number
+    n = len(weights)
+    total = sum(weights)
+    prob = array('d', (w * n / total for w in weights))
+    alias = array('Q', bytes(8 * n))
+    small = [i for i, p in enumerate(prob) if p < 1.0]
+    large = [i for i, p in enumerate(prob) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        g = large[-1]
+        alias[s] = g
+        prob[g] -= 1.0 - prob[s]
+        if prob[g] < 1.0:
+            small.append(large.pop())
+    # Whatever is left is 1 up to rounding error
+    for i in chain(small, large):
+        prob[i] = 1.0
+    return prob, alias
+
+def weighted_repeat(pairs, head_count, rng):
+    # Draw lines with replacement, proportionally to weight, in O(1) each
+    lines = []
+    weights = array('d')
+    for weight, line in pairs:
+        if weight > 0.0:
+            weights.append(weight)
+            lines.append(line)
+    if not lines:
+        return
+    prob, alias = alias_table(weights)
+    del weights
+    n = len(lines)
+    random = rng.random
+    draws = range(head_count) if head_count is not None else iter(int, 1)
+    for _ in draws:
+        u = random() * n
+        i = int(u)
+        yield lines[i] if u - i < prob[i] else lines[alias[i]]
+
+def weighted_sample(pairs, head_count, rng):
+    # Weighted sampling without replacement (Efraimidis-Spirakis): give
+    # each line the key log(u) / weight and output lines by decreasing key.
+    # With -n only the head_count best keys are kept, in one pass.
+    import heapq
+    from math import log
+    random = rng.random
+    keyed = ((log(1.0 - random()) / weight, line)
+             for weight, line in pairs if weight > 0.0)
+    if head_count is None:
+        return [line for _, line in sorted(keyed, reverse=True)]
+    return [line for _, line in heapq.nlargest(max(0, head_count), keyed)]
+
+def group_index(lines, field, separator):
+    # Hash-partition the lines by key in one pass: number each distinct
+    # key in order of first appearance and record every line's group. A
+    # counting sort then lists the line numbers group by group, with
+    # group g at order[starts[g]:starts[g + 1]], without sorting the input.
+    ids = {}
+    groups = array('Q')
+    for lineno, line in enumerate(lines, 1):
+        key = line_field(line, lineno, field, separator)
+        groups.append(ids.setdefault(key, len(ids)))
+    starts = array('Q', bytes(8 * (len(ids) + 1)))
+    for group in groups:
+        starts[group + 1] += 1
+    for group in range(len(ids)):
+        starts[group + 1] += starts[group]
+    fill = starts[:-1]
+    order = array('Q', bytes(8 * len(groups)))
+    for i, group in enumerate(groups):
+        order[fill[group]] = i
+        fill[group] += 1
+    return starts, order
+
+def grouped_shuffle(lines, field, separator, head_count, rng):
+    # Shuffle the order of the groups; each group's lines stay together
+    # in input order. head_count limits the number of groups.
+    starts, order = group_index(lines, field, separator)
+    groups = array('Q', range(len(starts) - 1))
+    rng.shuffle(groups)
+    if head_count is not None:
+        groups = groups[:max(0, head_count)]
+    for group in groups:
+        for i in order[starts[group]:starts[group + 1]]:
+            yield lines[i]
+
+def stratified_sample(lines, field, separator, quota, rng):
+    # Algorithm R run separately for each value of the key field, so every
+    # stratum contributes a uniform sample of up to quota lines. Only the
+    # samples are held in memory.
+    strata = {}
+    if quota <= 0:
+        return []
+    for lineno, line in enumerate(lines, 1):
+        key = line_field(line, lineno, field, separator)
+        stratum = strata.get(key)
+        if stratum is None:
+            stratum = strata[key] = [0, []]
+        seen = stratum[0]
+        stratum[0] = seen + 1
+        if seen < quota:
+            stratum[1].append(line)
+        else:
+            j = rng.randint(0, seen)
+            if j < quota:
+                stratum[1][j] = line
+    sample = [line for _, reservoir in strata.values() for line in reservoir]
+    rng.shuffle(sample)
+    return sample
+
+def load_numpy(engine):
+    # NumPy is optional; without it the pure-Python engine is used
+    if engine != 'numpy':
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def numpy_lines(np, data, starts, ends, repeat, head_count, rng,
+                last_newline=True):
+    # Batched engine: draw indices or a permutation in one call and gather
+    # whole chunks of output bytes at once from data[starts[i]:ends[i]].
+    # Without last_newline the final line lacks its newline, which is
+    # written into the gathered bytes.
+    gen = np.random.default_rng(rng.getrandbits(128))
+    n = len(starts)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    batch = 65536
+
+    def gather(idx):
+        first = starts[idx]
+        lengths = ends[idx] - first
+        if not last_newline:
+            last = idx == n - 1
+            lengths = lengths + last
+        stops = np.cumsum(lengths)
+        # Byte positions of every selected line, laid end to end
+        shift = np.repeat(first - (stops - lengths), lengths)
+        positions = shift + np.arange(shift.size)
+        if last_newline:
+            return buf[positions].tobytes()
+        # The added newline's position is one past the data
+        chunk = buf[np.minimum(positions, buf.size - 1)]
+        chunk[stops[last] - 1] = ord('\n')
+        return chunk.tobytes()
+
+    if repeat:
+        if head_count is None:
+            while True:
+                yield gather(gen.integers(0, n, size=batch))
+        while head_count > 0:
+            yield gather(gen.integers(0, n, size=min(batch, head_count)))
+            head_count -= batch
+    else:
+        order = gen.permutation(n)
+        if head_count is not None:
+            order = order[:max(0, head_count)]
+        for i in range(0, len(order), batch):
+            yield gather(order[i:i + batch])
+
+def numpy_mapped(np, mm, offsets, repeat, head_count, rng):
+    # A final line without a newline gets one as it is gathered, rather
+    # than from a copy of the whole mapping
+    starts = np.frombuffer(offsets, dtype=np.uint64).astype(np.int64)
+    ends = np.append(starts[1:], len(mm))
+    return numpy_lines(np, mm, starts, ends, repeat, head_count, rng,
+                       mm[-1:] == b'\n')
+
+def numpy_list(np, lines, repeat, head_count, rng):
+    # A LineArena already holds the lines as one buffer and its bounds
+    offsets = np.frombuffer(lines.offsets, dtype=f'u{lines.offsets.itemsize}')
+    offsets = offsets.astype(np.int64)
+    return numpy_lines(np, lines.data, offsets[:-1], offsets[1:],
+                       repeat, head_count, rng)
+
+def shuffle(iterable, k=None, repeat=False, rng=None):
+    '''Lazily yield the items of iterable in random order.
+
+    This is the library form of the command line: k is --head-count,
+    repeat is --repeat and rng is a random.Random to draw from (a fresh
+    one by default). Items are returned as-is. A range with step 1 is
+    shuffled without materializing it, and with k set (and no repeat)
+    other iterables are sampled in one pass holding only k items.
+
+    Example:
+        >>> import random, shuf
+        >>> list(shuf.shuffle(['a', 'b', 'c'], rng=random.Random(1)))
+        ['b', 'c', 'a']
+    '''
+    if rng is None:
+        rng = random.Random()
+    if isinstance(iterable, range) and iterable.step == 1:
+        if iterable:
+            yield from range_values(iterable.start, iterable.stop - 1,
+                                    repeat, k, rng)
+        return
+    if repeat:
+        population = list(iterable)
+        if population:
+            yield from repeat_choices(population, k, rng)
+    elif k is not None:
+        yield from reservoir_sample(iterable, k, rng)
+    else:
+        items = list(iterable)
+        rng.shuffle(items)
+        yield from items
+
+def redirect_output(path, inputs):
+    # Point standard output at path for -o, as GNU shuf does. If path is
+    # also an input, which may still be mapped or streamed while output is
+    # written, write to a temporary file beside it instead, and return its
+    # name so it can be renamed over path once the output is complete.
+    temp = None
+    try:
+        if os.path.exists(path) and any(
+                name != '-' and os.path.exists(name)
+                and os.path.samefile(name, path) for name in inputs):
+            import tempfile
+            fd, temp = tempfile.mkstemp(prefix='.shuf.',
+                                        dir=os.path.dirname(path) or '.')
+            os.chmod(temp, stat.S_IMODE(os.stat(path).st_mode))
+        else:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    except OSError as e:
+        sys.stderr.write(f"shuf: cannot open '{path}': {e.strerror}\n")
+        sys.exit(1)
+    os.dup2(fd, sys.stdout.fileno())
+    os.close(fd)
+    return temp
+
+def write_vectored(lines, stats=None):
+    # Write memoryviews of the input lines to stdout with writev(2) in
+    # batches of up to IOV_MAX, so line bytes are only copied by the
+    # kernel, not gathered into a buffer first
+    try:
+        iov_max = os.sysconf('SC_IOV_MAX')
+    except (ValueError, OSError):
+        iov_max = 1024
+    fd = sys.stdout.fileno()
+    clock = time.perf_counter
+    start = clock()
+    writing = 0.0
+    batch = []
+    try:
+        for line in chain(lines, [None]):
+            if line is not None:
+                batch.append(line)
+                if len(batch) < iov_max:
+                    continue
+            if not batch:
+                break
+            before = clock()
+            size = writev_all(fd, batch)
+            writing += clock() - before
+            if stats is not None:
+                stats['lines_written'] += len(batch)
+                stats['bytes_written'] += size
+            batch = []
+    finally:
+        if stats is not None:
+            stats['time']['shuffle'] = clock() - start - writing
+            stats['time']['write'] = writing
+
+def writev_all(fd, buffers):
+    # writev may stop short; resubmit whatever wasn't written
+    size = total = sum(map(len, buffers))
+    while True:
+        written = os.writev(fd, buffers)
+        total -= written
+        if total <= 0:
+            return size
+        i = 0
+        while written >= len(buffers[i]):
+            written -= len(buffers[i])
+            i += 1
+        buffers = [memoryview(buffers[i])[written:]] + buffers[i + 1:]
+
+def write_lines(lines, buffer_size, stats=None, flush=False,
+                compress=None):
+    # Gather lines into large chunks and write them straight to the
+    # binary stdout, instead of one print() per line. With flush, every
+    # chunk is pushed out to the file descriptor right away.
+    if stats is not None:
+        return write_lines_timed(lines, buffer_size, stats, flush, compress)
+    write, finish = output_writer(sys.stdout.buffer, flush, compress)
+    buf = bytearray()
+    for line in lines:
+        buf += line
+        if len(buf) >= buffer_size:
+            write(buf)
+            buf.clear()
+    write(buf)
+    finish()
+
+def output_writer(out, flush=False, compress=None):
+    # Return write(data) and finish() functions for the binary stream out,
+    # compressing with compress if it is set
+    compressor = new_compressor(compress) if compress else None
+
+    def write(data):
+        if compressor is not None:
+            data = compressor.compress(data)
+        out.write(data)
+        if flush:
+            out.flush()
+
+    def finish():
+        if compressor is not None:
+            out.write(compressor.flush())
+        out.flush()
+
+    if compressor is None and not flush:
+        write = out.write
+    return write, finish
+
+def write_lines_timed(lines, buffer_size, stats, flush=False, compress=None):
+    # Same as write_lines, but keeps the time spent producing lines apart
+    # from the time spent writing them, and counts the output
+    write, finish = output_writer(sys.stdout.buffer, flush, compress)
+    clock = time.perf_counter
+    buf = bytearray()
+    start = clock()
+    writing = 0.0
+
+    def flush():
+        nonlocal writing
+        stats['lines_written'] += buf.count(b'\n')
+        stats['bytes_written'] += len(buf)
+        before = clock()
+        write(buf)
+        writing += clock() - before
+        buf.clear()
+
+    try:
+        for line in lines:
+            buf += line
+            if len(buf) >= buffer_size:
+                flush()
+        flush()
+        before = clock()
+        finish()
+        writing += clock() - before
+    finally:
+        stats['time']['shuffle'] = clock() - start - writing
+        stats['time']['write'] = writing
+
+def shard_writer(f, chunks, errors, compress):
+    # Writer thread for one shard: write (and compress) chunks until a None
+    # arrives
+    try:
+        write, finish = output_writer(f, compress=compress)
+        for chunk in iter(chunks.get, None):
+            write(chunk)
+        finish()
+    except OSError as e:
+        errors.append((f.name, e))
+        # Keep draining so the dealer never blocks on a full queue
+        for chunk in iter(chunks.get, None):
+            pass
+
+def write_shards(lines, shards, prefix, buffer_size, stats=None,
+                 compress=None):
+    # Deal the shuffled lines round-robin into shards files, so shard i
+    # gets lines i, i + shards, ... and sizes differ by at most one line.
+    # Each shard has its own writer thread fed whole chunks.
+    import queue
+    import threading
+    width = max(2, len(str(shards - 1)))
+    suffix = COMPRESSION_SUFFIXES[compress] if compress else ''
+    paths = [f'{prefix}{i:0{width}d}{suffix}' for i in range(shards)]
+    files = []
+    for path in paths:
+        try:
+            files.append(open(path, 'wb', buffering=0))
+        except IOError as e:
+            sys.stderr.write(f"shuf: cannot open '{path}': {e.strerror}\n")
+            sys.exit(1)
+    errors = []
+    queues = [queue.Queue(maxsize=4) for _ in range(shards)]
+    threads = [threading.Thread(target=shard_writer,
+                                args=(f, q, errors, compress))
+               for f, q in zip(files, queues)]
+    for thread in threads:
+        thread.start()
+    bufs = [bytearray() for _ in range(shards)]
+    start = time.perf_counter()
+    count = 0
+    written = 0
+    try:
+        for count, line in enumerate(lines, 1):
+            shard = (count - 1) % shards
+            buf = bufs[shard]
+            buf += line
+            if len(buf) >= buffer_size:
+                written += len(buf)
+                queues[shard].put(bytes(buf))
+                buf.clear()
+        for buf, chunks in zip(bufs, queues):
+            if buf:
+                written += len(buf)
+                chunks.put(bytes(buf))
+    finally:
+        for chunks in queues:
+            chunks.put(None)
+        for thread in threads:
+            thread.join()
+        for f in files:
+            f.close()
+        if stats is not None:
+            # Writing overlaps with producing lines, so it isn't split out
+            stats['time']['shuffle'] = time.perf_counter() - start
+            stats['lines_written'] = count
+            stats['bytes_written'] = written
+    if errors:
+        path, e = errors[0]
+        sys.stderr.write(f"shuf: write error on '{path}': {e.strerror}\n")
+        sys.exit(1)
+
+def counted(lines, stats):
+    # Count streamed input lines as they go by
+    for line in lines:
+        stats['lines_read'] += 1
+        stats['bytes_read'] += len(line)
+        yield line
+
+def new_stats():
+    return {
+        'strategy': None,
+        'lines_read': 0,
+        'bytes_read': 0,
+        'lines_written': 0,
+        'bytes_written': 0,
+        'time': {'read': 0.0, 'shuffle': 0.0, 'write': 0.0, 'total': 0.0},
+        'peak_rss': None,
+    }
+
+def report_stats(stats, start):
+    import json
+    stats['time']['total'] = time.perf_counter() - start
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        stats['peak_rss'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss * scale
+    sys.stderr.write(json.dumps(stats) + '\n')
+
+def select_output(args, stats, mapper=None):
+    # Pick the cheapest strategy for the input and options, and return a
+    # generator of output lines. Eager input (file indexing, reading lines
+    # into a list) happens here; streamed input is read while writing.
+    # Input is only counted into stats with --stats. mapper replaces
+    # map_files, e.g. with the server's index cache.
+    rng = make_rng(args)
+    if args.input_range:
+        lo, hi = parse_range(args.input_range)
+        if args.repeat or args.head_count is not None:
+            stats['strategy'] = 'range-sample'
+        else:
+            stats['strategy'] = 'range-permute'
+        if args.stats:
+            stats['lines_read'] = hi - lo + 1
+        return range_lines(lo, hi, args.repeat, args.head_count, rng)
+    if args.window is not None:
+        stats['strategy'] = 'window'
+        lines = iter_input(args) if not args.echo else read_input(args)
+        if args.stats:
+            lines = counted(lines, stats)
+        lines = window_shuffle(lines, args.window, rng)
+        if args.head_count is not None:
+            from itertools import islice
+            lines = islice(lines, max(0, args.head_count))
+        return lines
+    if args.weights or args.weight_field is not None:
+        lines = read_input(args) if args.echo else iter_input(args)
+        if args.stats:
+            lines = counted(lines, stats)
+        if args.weights:
+            pairs = file_weights(lines, args.weights)
+        else:
+            pairs = field_weights(lines, args.weight_field,
+                                  args.field_separator)
+        if args.repeat:
+            stats['strategy'] = 'weighted-alias'
+            return weighted_repeat(pairs, args.head_count, rng)
+        stats['strategy'] = 'weighted-sample'
+        return weighted_sample(pairs, args.head_count, rng)
+    if args.stratify is not None:
+        stats['strategy'] = 'stratified'
+        lines = read_input(args) if args.echo else iter_input(args)
+        if args.stats:
+            lines = counted(lines, stats)
+        return stratified_sample(lines, args.stratify, args.field_separator,
+                                 args.head_count, rng)
+    if args.group_key is not None:
+        stats['strategy'] = 'grouped'
+        lines = read_input(args)
+        if args.stats:
+            stats['lines_read'] = len(lines)
+            stats['bytes_read'] = lines.nbytes
+        return grouped_shuffle(lines, args.group_key, args.field_separator,
+                               args.head_count, rng)
+    mapped = None
+    if (args.head_count is not None and not args.repeat
+            and not args.echo and mapper is None):
+        # Stream file/stdin input so memory stays proportional to COUNT.
+        # With a mapper the index is likely cached, and sampling from it
+        # saves reading the whole input again; so is a sidecar index, if
+        # the input can be mapped.
+        if args.index_cache:
+            mapped = map_files(args.files, True)
+        if mapped is None:
+            stats['strategy'] = 'reservoir'
+            lines = iter_input(args)
+            if args.stats:
+                lines = counted(lines, stats)
+            return reservoir_sample(lines, args.head_count, rng)
+    if (args.memory_limit is not None and not args.repeat
+            and not args.echo and args.head_count is None):
+        size_hint = None
+        if all(path != '-' and os.path.isfile(path) for path in args.files):
+            size_hint = sum(os.path.getsize(path) for path in args.files)
+        if size_hint is None or size_hint > args.memory_limit:
+            stats['strategy'] = 'external'
+            lines = iter_input(args)
+            if args.stats:
+                lines = counted(lines, stats)
+            return external_shuffle(lines, args.memory_limit,
+                                    args.temp_dir, rng, size_hint)
+    # The NumPy engine yields multi-line chunks, which can't be dealt out
+    # to shards line by line
+    np = load_numpy(args.engine) if not args.shards else None
+    if not args.echo:
+        if mapped is None and mapper is None:
+            mapped = map_files(args.files, args.index_cache)
+        elif mapped is None:
+            mapped = mapper(args.files)
+        if mapped is not None:
+            maps, keys = mapped
+            if args.stats:
+                stats['lines_read'] = len(keys)
+                stats['bytes_read'] = sum(len(mm) for mm in maps)
+            if np is not None and len(maps) == 1 and keys:
+                stats['strategy'] = 'numpy-mmap'
+                return numpy_mapped(np, maps[0], keys, args.repeat,
+                                    args.head_count, rng)
+            # Output to a file can take long lines straight from the
+            # mappings with writev; see write_vectored
+            views = (bool(args.output) and not args.compress
+                     and sum(map(len, maps)) >= WRITEV_MIN_LINE * len(keys))
+            stats['strategy'] = 'mmap-writev' if views else 'mmap'
+            return shuffle_offsets(maps, keys, args.repeat, args.head_count,
+                                   rng, views)
+    lines = read_input(args)
+    if args.stats:
+        stats['lines_read'] = len(lines)
+        stats['bytes_read'] = lines.nbytes
+    if np is not None and lines:
+        stats['strategy'] = 'numpy'
+        return numpy_list(np, lines, args.repeat, args.head_count, rng)
+    stats['strategy'] = 'in-memory'
+    return shuffle_lines(lines, args.repeat, args.head_count, rng)
+
+class ServerError(Exception):
+    # A --serve process rejected a request
+    pass
+
+class IndexCache:
+    # LRU cache of file indexes for the server, keyed by path and the
+    # file's identity, so a changed file is indexed again. Requests run in
+    # worker threads, so the entries are only touched under a lock.
+
+    def __init__(self, size, sidecar=False):
+        import threading
+        self.size = size
+        self.sidecar = sidecar
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def map_files(self, paths):
+        try:
+            key = tuple((path, st.st_dev, st.st_ino, st.st_size,
+                         st.st_mtime_ns)
+                        for path, st in zip(paths, map(os.stat, paths)))
+        except OSError:
+            return map_files(paths, self.sidecar)
+        with self.lock:
+            mapped = self.entries.pop(key, None)
+        if mapped is None:
+            mapped = map_files(paths, self.sidecar)
+            if mapped is None:
+                return None
+        with self.lock:
+            self.entries[key] = mapped
+            while len(self.entries) > self.size:
+                del self.entries[next(iter(self.entries))]
+        maps, keys = mapped
+        # The shuffle permutes keys in place, so hand out a copy
+        return maps, keys[:]
+
+class CapturedStderr:
+    # Stands in for sys.stderr in the server. What a thread writes while
+    # call_captured runs a request goes to that request's buffer, so
+    # requests in different threads don't see each other's messages.
+
+    def __init__(self, stream):
+        import threading
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buf', None)
+        return (self.stream if buf is None else buf).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def call_captured(func, *args):
+    # Run func, turning the "shuf: ..." message and exit of a failed
+    # request into a ServerError instead of ending the server. Needs
+    # sys.stderr to be a CapturedStderr, as serve() sets it.
+    import io
+    local = sys.stderr.local
+    local.buf = io.StringIO()
+    try:
+        return func(*args)
+    except SystemExit:
+        message = local.buf.getvalue().strip() or 'request failed'
+        raise ServerError(message.removeprefix('shuf: '))
+    finally:
+        local.buf = None
+
+def request_args(request, server_args):
+    # Build the options for one server request. Only the shuffle options
+    # come from the client; the rest are the server's own settings.
+    from types import SimpleNamespace
+    files = [str(path) for path in request.get('files') or []]
+    echo = request.get('echo')
+    input_range = request.get('input_range')
+    if not (files or echo or input_range):
+        raise ServerError('request has no input')
+    if '-' in files:
+        raise ServerError('the server cannot read standard input')
+    if echo and input_range:
+        raise ServerError('echo and input_range are mutually exclusive')
+    head_count = request.get('head_count')
+    seed = request.get('seed')
+    if head_count is not None and not isinstance(head_count, int):
+        raise ServerError(f"invalid head count: '{head_count}'")
+    if seed is not None and not isinstance(seed, int):
+        raise ServerError(f"invalid seed: '{seed}'")
+    weights = request.get('weights')
+    weight_field = request.get('weight_field')
+    separator = request.get('field_separator')
+    if weight_field is not None and (not isinstance(weight_field, int)
+                                     or weight_field <= 0):
+        raise ServerError(f"invalid field number: '{weight_field}'")
+    if weights and weight_field is not None:
+        raise ServerError('weights and weight_field are mutually exclusive')
+    if (weights or weight_field is not None) and input_range:
+        raise ServerError('weighted sampling does not apply to input_range')
+    group_key = request.get('group_key')
+    stratify = request.get('stratify')
+    for field in (group_key, stratify):
+        if field is not None and (not isinstance(field, int) or field <= 0):
+            raise ServerError(f"invalid field number: '{field}'")
+    if group_key is not None or stratify is not None:
+        if group_key is not None and stratify is not None:
+            raise ServerError('group_key and stratify are mutually exclusive')
+        if (input_range or request.get('repeat') or weights
+                or weight_field is not None):
+            raise ServerError('grouping does not apply to input_range, '
+                              'repeat or weighted sampling')
+        if stratify is not None and head_count is None:
+            raise ServerError('stratify requires head_count')
+    return SimpleNamespace(
+        echo=[str(line) for line in echo] if echo else None,
+        input_range=str(input_range) if input_range else None,
+        head_count=head_count,
+        repeat=bool(request.get('repeat')),
+        shards=None,
+        window=None,
+        weights=str(weights) if weights else None,
+        weight_field=weight_field,
+        group_key=group_key,
+        stratify=stratify,
+        field_separator=(os.fsencode(str(separator)) if separator
+                         else None),
+        files=files,
+        seed=seed,
+        random_source=None,
+        output=None,
+        buffer_size=server_args.buffer_size,
+        engine=server_args.engine,
+        memory_limit=server_args.memory_limit,
+        temp_dir=server_args.temp_dir,
+        index_cache=server_args.index_cache,
+        stats=False,
+    )
+
+def chunked(lines, buffer_size):
+    # Gather lines into chunks of about buffer_size bytes
+    buf = bytearray()
+    for line in lines:
+        buf += line
+        if len(buf) >= buffer_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+async def handle_request(reader, writer, server_args, cache):
+    # One request per connection: a JSON line in, then "ok" and the
+    # shuffled output out, in chunks each led by a line with its length
+    # and ended by a "0" line. An "error: MESSAGE" line in place of "ok"
+    # or of a length reports a failure, so output cut short by an error
+    # can't pass for all of it. Indexing and each chunk of output run in
+    # the loop's thread pool, so one request reading a large file doesn't
+    # hold up the others.
+    import asyncio
+    import json
+    loop = asyncio.get_running_loop()
+    try:
+        try:
+            request = json.loads(await reader.readline())
+            if not isinstance(request, dict):
+                raise ServerError('request must be a JSON object')
+            args = request_args(request, server_args)
+            lines = await loop.run_in_executor(
+                None, call_captured, select_output, args, new_stats(),
+                cache.map_files)
+            writer.write(b'ok\n')
+            chunks = chunked(lines, args.buffer_size)
+            while True:
+                chunk = await loop.run_in_executor(None, call_captured, next,
+                                                   chunks, None)
+                if chunk is None:
+                    break
+                writer.write(b'%d\n' % len(chunk))
+                writer.write(chunk)
+                await writer.drain()
+            writer.write(b'0\n')
+        except (ValueError, ServerError) as e:
+            writer.write(f'error: {e}\n'.encode())
+        await writer.drain()
+    except ConnectionError:
+        # The client went away
+        pass
+    finally:
+        writer.close()
+
+def serve(args):
+    import asyncio
+    import signal
+    cache = IndexCache(args.cache_size, args.index_cache)
+
+    async def run():
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: handle_request(reader, writer, args, cache),
+            path=args.serve, limit=MAX_REQUEST)
+        # Stop cleanly on SIGINT/SIGTERM so the socket file is removed
+        stop = asyncio.get_running_loop().create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(
+                signum, lambda: stop.done() or stop.set_result(None))
+        async with server:
+            await stop
+
+    if os.path.exists(args.serve):
+        os.remove(args.serve)
+    sys.stderr = CapturedStderr(sys.stderr)
+    try:
+        asyncio.run(run())
+    finally:
+        if os.path.exists(args.serve):
+            os.remove(args.serve)
+
+def connect(socket_path, request):
+    '''Send a shuffle request to a --serve process and yield its output.
+
+    request is a dict with any of the keys echo (list of str),
+    input_range ('LO-HI'), files (list of paths the server can open),
+    head_count, repeat, seed, weights (path), weight_field, group_key,
+    stratify and field_separator. Output is yielded as chunks of bytes.
+
+    Raises:
+        ServerError - if the server rejects the request, fails partway
+                      through the output or closes the connection early
+        OSError - if the server can't be reached
+    '''
+    import json
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            status = f.readline()
+            if status == b'ok\n':
+                status = f.readline()
+                while status[:-1].isdigit() and status != b'0\n':
+                    size = int(status)
+                    chunk = f.read(size)
+                    if len(chunk) < size:
+                        status = b''
+                        break
+                    yield chunk
+                    status = f.readline()
+                if status == b'0\n':
+                    return
+            message = status.decode(errors='replace').strip()
+            raise ServerError(message.removeprefix('error: ')
+                              or 'connection closed')
+
+def client_request(args):
+    # Turn the command line into a server request. Standard input is read
+    # here and sent as lines, since the server can't see it.
+    request = {'head_count': args.head_count, 'repeat': args.repeat,
+               'seed': args.seed, 'weight_field': args.weight_field,
+               'group_key': args.group_key, 'stratify': args.stratify}
+    if args.weights:
+        request['weights'] = os.path.abspath(args.weights)
+    if args.field_separator is not None:
+        request['field_separator'] = os.fsdecode(args.field_separator)
+    if args.echo:
+        request['echo'] = args.echo
+    elif args.input_range:
+        request['input_range'] = args.input_range
+    elif args.files == ['-']:
+        request['echo'] = [os.fsdecode(line.rstrip(b'\n'))
+                           for line in sys.stdin.buffer]
+        if not request['echo']:
+            return None
+    else:
+        request['files'] = [os.path.abspath(path) for path in args.files]
+    return request
+
+def client_output(args):
+    request = client_request(args)
+    if request is None:
+        return
+    try:
+        yield from connect(args.connect, request)
+    except (ServerError, OSError) as e:
+        message = getattr(e, 'strerror', None) or e
+        sys.stderr.write(f"shuf: {args.connect}: {message}\n")
+        sys.exit(1)
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+    start = time.perf_counter()
+    stats = new_stats()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    temp = None
+    try:
+        if args.connect:
+            lines = client_output(args)
+        else:
+            lines = select_output(args, stats)
+        stats['time']['read'] = time.perf_counter() - start
+        if args.output:
+            temp = redirect_output(args.output, args.files)
+        if args.shards:
+            write_shards(lines, args.shards, args.output_prefix,
+                         args.buffer_size, stats if args.stats else None,
+                         args.compress)
+        elif stats['strategy'] == 'mmap-writev':
+            write_vectored(lines, stats if args.stats else None)
+        else:
+            # A window streams live input, so its output is written as
+            # soon as each line is chosen
+            write_lines(lines, 1 if args.window else args.buffer_size,
+                        stats if args.stats else None,
+                        flush=bool(args.window), compress=args.compress)
+        if temp is not None:
+            os.replace(temp, args.output)
+            temp = None
+    except BrokenPipeError:
+        # The reader went away (e.g. "shuf.py -r | head"); point stdout at
+        # /dev/null so the interpreter's final flush doesn't fail again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if temp is not None:
+            os.remove(temp)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats:
+            report_stats(stats, start)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+'''Tests of shuf.py.
+
+The shuffling building blocks are tested directly; the options that
+depend on files, pipes or a server are tested by running shuf.py.
+'''
+import bz2
+import gzip
+import json
+import lzma
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from array import array
+from collections import Counter
+from unittest import mock
+
+import shuf
+
+SHUF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shuf.py')
+
+def run_shuf(*args, stdin=None, env=None):
+    '''Run shuf.py with args and return the finished process.'''
+    return subprocess.run([sys.executable, SHUF, *args], input=stdin,
+                          capture_output=True, env=env)
+
+def numbered(count, prefix=b''):
+    '''Return count distinct newline-terminated lines.'''
+    return [b'%s%d\n' % (prefix, i) for i in range(count)]
+
+def output_lines(result):
+    '''Return the sorted output lines of a finished shuf.py.'''
+    return sorted(result.stdout.splitlines(keepends=True))
+
+class TestShuf(unittest.TestCase):
+    '''Shuffle, sampling and indexing strategies of shuf.py'''
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name, lines=None):
+        '''Return a path in the test directory, writing lines to it.'''
+        path = os.path.join(self.tmp.name, name)
+        if lines is not None:
+            with open(path, 'wb') as f:
+                f.writelines(lines)
+        return path
+
+    def start_server(self):
+        '''Start a --serve process and return its socket path.'''
+        sock = self.path('sock')
+        server = subprocess.Popen([sys.executable, SHUF, '--serve', sock],
+                                  stderr=subprocess.DEVNULL)
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX) as probe:
+                    probe.connect(sock)
+                return sock
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_reservoir_sample(self):
+        '''reservoir_sample() keeps COUNT distinct lines of its input.'''
+        lines = numbered(1000)
+        rng = random.Random(6)
+        for count in (0, 1, 10, 1000, 2000):
+            sample = shuf.reservoir_sample(iter(lines), count, rng)
+            self.assertEqual(len(sample), min(count, len(lines)))
+            self.assertEqual(len(set(sample)), len(sample))
+            self.assertTrue(set(sample) <= set(lines))
+
+    def test_head_count_input(self):
+        '''-n samples standard input and FILE alike.'''
+        lines = numbered(100)
+        for args, stdin in ((['-n', '5'], b''.join(lines)),
+                            (['-n', '5', self.path('input', lines)], None)):
+            result = run_shuf(*args, stdin=stdin)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            output = output_lines(result)
+            self.assertEqual(len(set(output)), 5)
+            self.assertTrue(set(output) <= set(lines))
+
+    def test_mapped_file(self):
+        '''A mapped FILE without a final newline or with no lines.'''
+        result = run_shuf(self.path('input', [b'a\n', b'b\n', b'c']))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), [b'a\n', b'b\n', b'c\n'])
+        result = run_shuf(self.path('empty', []))
+        self.assertEqual((result.returncode, result.stdout), (0, b''))
+
+    def test_buffer_size(self):
+        '''Lines longer than --buffer-size are still written whole.'''
+        lines = numbered(50, b'x' * 100)
+        result = run_shuf('--buffer-size', '16', stdin=b''.join(lines))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), sorted(lines))
+
+    def test_repeat_into_closed_pipe(self):
+        '''-r stops quietly once its reader goes away, as under head.'''
+        proc = subprocess.Popen([sys.executable, SHUF, '-r', '-i', '1-5'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        proc.stdout.readline()
+        proc.stdout.close()
+        self.assertEqual(proc.stderr.read(), b'')
+        proc.stderr.close()
+        proc.wait()
+
+    def test_permuted_range_is_bijection(self):
+        '''permuted_range() yields each of range(n) exactly once.'''
+        for n in (1, 2, 3, 5, 15, 16, 17, 63, 64, 65, 1000, 4097, 65537):
+            values = list(shuf.permuted_range(n, random.Random(n)))
+            self.assertEqual(sorted(values), list(range(n)), n)
+        # Neighbours in the input end up far apart
+        gaps = [abs(x - y) for x, y in zip(values, values[1:])]
+        self.assertGreater(sum(gaps) / len(gaps), n / 4)
+
+    def test_floyd_sample_is_distinct(self):
+        '''floyd_sample() picks k distinct values from range(n).'''
+        rng = random.Random(1)
+        for n, k in ((1, 1), (10, 0), (10, 3), (10, 10), (10 ** 12, 1000)):
+            picks = shuf.floyd_sample(n, k, rng)
+            self.assertEqual(len(picks), k)
+            self.assertTrue(all(0 <= x < n for x in picks))
+
+    def test_range_head_count(self):
+        '''-n covering the range returns it all, and a huge range with a
+        huge COUNT starts without holding the picks.'''
+        rng = random.Random(2)
+        for count in (5, 10, 11):
+            values = list(shuf.range_values(1, 10, False, count, rng))
+            self.assertEqual(len(values), min(count, 10))
+            self.assertEqual(len(set(values)), len(values))
+        values = shuf.range_values(1, 10 ** 10, False, 2 * 10 ** 10, rng)
+        self.assertTrue(1 <= next(values) <= 10 ** 10)
+
+    def test_numpy_engine(self):
+        '''--engine numpy shuffles, with NumPy or without it.'''
+        self.assertIsNone(shuf.load_numpy('python'))
+        lines = numbered(1000)
+        for args, stdin in ((['--engine', 'numpy'], b''.join(lines)),
+                            (['--engine', 'numpy', '-n', '10',
+                              self.path('input', lines)], None)):
+            result = run_shuf(*args, stdin=stdin)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            output = output_lines(result)
+            self.assertEqual(len(set(output)), len(output))
+            self.assertTrue(set(output) <= set(lines))
+            self.assertEqual(len(output), 10 if '-n' in args else 1000)
+
+    def test_numpy_final_newline(self):
+        '''The NumPy engine ends a mapped file's last line with a newline,
+        without copying the mapping to add it.'''
+        np = shuf.load_numpy('numpy')
+        if np is None:
+            self.skipTest('NumPy is not installed')
+        lines = numbered(1000)
+        for data in (b''.join(lines)[:-1], b'x'):
+            path = self.path('input', [data])
+            maps, keys = shuf.map_files([path])
+            for repeat, count in ((False, None), (False, 3), (True, 2000)):
+                chunks = shuf.numpy_mapped(np, maps[0], keys, repeat, count,
+                                           random.Random(10))
+                output = b''.join(chunks).splitlines(keepends=True)
+                expected = data.splitlines(keepends=False)
+                self.assertTrue(all(line.endswith(b'\n') for line in output))
+                self.assertTrue({line[:-1] for line in output}
+                                <= set(expected))
+                if not repeat:
+                    count = min(count or len(expected), len(expected))
+                self.assertEqual(len(output), count)
+            with mock.patch.object(shuf, 'numpy_lines') as numpy_lines:
+                shuf.numpy_mapped(np, maps[0], keys, False, None,
+                                  random.Random(10))
+            self.assertIs(numpy_lines.call_args.args[1], maps[0])
+
+    def test_external_shuffle_keeps_lines(self):
+        '''A shuffle through bucket files outputs every line once.'''
+        lines = numbered(5000)
+        output = list(shuf.external_shuffle(lines, 1000, self.tmp.name,
+                                            random.Random(3),
+                                            sum(map(len, lines))))
+        self.assertEqual(sorted(output), sorted(lines))
+        self.assertNotEqual(output, lines)
+        path = self.path('input', lines)
+        result = run_shuf('-S', '1K', '-T', self.tmp.name, path)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), sorted(lines))
+
+    def test_multiple_files(self):
+        '''Several FILEs are shuffled together as one input.'''
+        first = numbered(300, b'a')
+        second = numbered(200, b'b')
+        paths = [self.path('first', first), self.path('second', second)]
+        maps, keys = shuf.map_files(paths)
+        self.assertEqual(sorted(shuf.mapped_line(maps, key) for key in keys),
+                         sorted(first + second))
+        result = run_shuf(*paths)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), sorted(first + second))
+
+    def test_number_offsets(self):
+        '''number_offsets() puts the file number above every offset.'''
+        offsets = array('Q', [0, 5, (1 << shuf.OFFSET_BITS) - 1])
+        expected = [(3 << shuf.OFFSET_BITS) | x for x in offsets]
+        self.assertEqual(list(shuf.number_offsets(offsets, 3)), expected)
+        self.assertEqual(list(shuf.number_offsets(array('Q', [7]), 0)), [7])
+
+    def test_seed(self):
+        '''--seed and --random-source repeat their shuffle.'''
+        path = self.path('input', numbered(100))
+        first = run_shuf('--seed', '1', path).stdout
+        self.assertEqual(run_shuf('--seed', '1', path).stdout, first)
+        self.assertNotEqual(run_shuf('--seed', '2', path).stdout, first)
+        source = self.path('source', [os.urandom(4096)])
+        first = run_shuf('--random-source', source, '-i', '1-50').stdout
+        self.assertEqual(sorted(first.split()),
+                         sorted(b'%d' % i for i in range(1, 51)))
+        self.assertEqual(run_shuf('--random-source', source,
+                                  '-i', '1-50').stdout, first)
+
+    def test_substream(self):
+        '''substream() depends on both its seed and its index.'''
+        draws = [[shuf.substream(base, index).random() for _ in range(3)]
+                 for base, index in ((5, 0), (5, 0), (5, 1), (6, 0))]
+        self.assertEqual(draws[0], draws[1])
+        self.assertNotEqual(draws[0], draws[2])
+        self.assertNotEqual(draws[0], draws[3])
+
+    def test_stats(self):
+        '''--stats reports the strategy as JSON on standard error.'''
+        result = run_shuf('--stats', '-i', '1-3')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        stats = json.loads(result.stderr.splitlines()[-1])
+        self.assertIn('strategy', stats)
+
+    def test_stats_env(self):
+        '''SHUF_STATS=1 turns --stats on and SHUF_STATS=0 leaves it off.'''
+        for value, expected in (('1', True), ('0', False), ('', False)):
+            env = dict(os.environ, SHUF_STATS=value)
+            result = run_shuf('-i', '1-3', env=env)
+            self.assertEqual(b'"strategy"' in result.stderr, expected, value)
+
+    def test_shuffle_api(self):
+        '''shuffle() returns items as-is and samples lazily.'''
+        rng = random.Random(7)
+        items = ['a', 'b', 'c', 4]
+        self.assertEqual(sorted(map(str, shuf.shuffle(items, rng=rng))),
+                         ['4', 'a', 'b', 'c'])
+        picks = list(shuf.shuffle(range(10, 10 ** 12), k=5, rng=rng))
+        self.assertEqual(len(set(picks)), 5)
+        self.assertTrue(all(10 <= x < 10 ** 12 for x in picks))
+        picks = list(shuf.shuffle(iter('xyz'), k=2, rng=rng))
+        self.assertEqual(len(set(picks)), 2)
+        picks = list(shuf.shuffle('xy', k=10, repeat=True, rng=rng))
+        self.assertEqual((len(picks), set(picks) <= {'x', 'y'}), (10, True))
+        self.assertEqual(list(shuf.shuffle([], k=3, repeat=True)), [])
+        code = 'import sys, shuf; print("argparse" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=os.path.dirname(SHUF),
+                                capture_output=True)
+        self.assertEqual(result.stdout, b'False\n', result.stderr)
+
+    def test_serve(self):
+        '''A --serve process takes requests past the 64 KiB line limit.'''
+        sock = self.start_server()
+        lines = numbered(20000)
+        result = run_shuf('--connect', sock, stdin=b''.join(lines))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), sorted(lines))
+        result = run_shuf('--connect', sock, '-n', '3',
+                          self.path('input', lines))
+        self.assertEqual(len(result.stdout.splitlines()), 3, result.stderr)
+
+    def test_serve_error_after_ok(self):
+        '''A request that fails once its output has begun fails the client.'''
+        sock = self.start_server()
+        path = self.path('input', [b'a 1\n', b'b x\n'])
+        result = run_shuf('--connect', sock, '-r', '-n', '5',
+                          '--weight-field', '2', path)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn(b"invalid weight: 'x'", result.stderr)
+
+    def test_connect_rejects_server_options(self):
+        '''Options the server doesn't take from a client are refused.'''
+        for args in (['--window', '3'], ['--random-source', SHUF],
+                     ['-S', '1M'], ['-T', self.tmp.name],
+                     ['--engine', 'numpy'], ['--index-cache']):
+            result = run_shuf('--connect', self.path('sock'), *args, SHUF)
+            self.assertEqual(result.returncode, 2, args)
+            self.assertIn(b'--connect are mutually exclusive', result.stderr)
+
+    def test_alias_table_probabilities(self):
+        '''Each index of an alias table is drawn with its weight's share.'''
+        weights = [1.0, 2.0, 3.0, 4.0, 0.5, 9.5]
+        prob, alias = shuf.alias_table(weights)
+        n = len(weights)
+        chance = [p / n for p in prob]
+        for i in range(n):
+            chance[alias[i]] += (1.0 - prob[i]) / n
+        for share, weight in zip(chance, weights):
+            self.assertAlmostEqual(share, weight / sum(weights))
+
+    def test_zero_weights(self):
+        '''Lines weighted 0 are never output.'''
+        lines = b'a 0\nb 1\nc 0\nd 2\n'
+        for args in ((), ('-r', '-n', '50')):
+            result = run_shuf('--weight-field', '2', *args, stdin=lines)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertEqual(set(result.stdout.splitlines()),
+                             {b'b 1', b'd 2'})
+
+    def test_shard_sizes(self):
+        '''Shards split the output evenly and cover it exactly.'''
+        lines = numbered(10)
+        prefix = self.path('part')
+        result = run_shuf('--shards', '3', '--output-prefix', prefix,
+                          self.path('input', lines))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        shards = []
+        for i in range(3):
+            with open(f'{prefix}{i:02d}', 'rb') as f:
+                shards.append(f.read().splitlines(keepends=True))
+        self.assertEqual([len(shard) for shard in shards], [4, 3, 3])
+        self.assertEqual(sorted(sum(shards, [])), sorted(lines))
+
+    def test_window(self):
+        '''A line moves at most K places earlier through --window K.'''
+        lines = numbered(1000)
+        output = list(shuf.window_shuffle(iter(lines), 10, random.Random(8)))
+        self.assertEqual(sorted(output), sorted(lines))
+        position = {line: i for i, line in enumerate(lines)}
+        self.assertTrue(all(position[line] <= i + 10
+                            for i, line in enumerate(output)))
+        result = run_shuf('--window', '10', stdin=b''.join(lines))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(output_lines(result), sorted(lines))
+
+    def test_compressed_input(self):
+        '''Compressed input is read and -z output compressed, per method.'''
+        lines = numbered(1000)
+        data = b''.join(lines)
+        modules = {'gzip': gzip, 'bz2': bz2, 'xz': lzma}
+        for method, module in modules.items():
+            path = self.path('input.' + method, [module.compress(data)])
+            for args, stdin in (([path], None), ([], module.compress(data))):
+                result = run_shuf(*args, stdin=stdin)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertEqual(output_lines(result), sorted(lines))
+            result = run_shuf('-z', method, '-n', '10', path)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            output = module.decompress(result.stdout).splitlines(True)
+            self.assertEqual(len(set(output)), 10)
+            self.assertTrue(set(output) <= set(lines))
+
+    def test_decompression_stops(self):
+        '''Closing a compressed input early stops its reader thread.'''
+        path = self.path('input.gz', [gzip.compress(b''.join(
+            numbered(200000, b'x' * 50)))])
+        threads = threading.active_count()
+        lines = shuf.iter_file(path)
+        next(lines)
+        lines.close()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_text_like_compressed(self):
+        '''Text starting with a magic number, or with a whole header that
+        fails to decompress, is read as text.'''
+        for data in (b'BZhang\nworld\n', b'BZh91AY&SY, not bz2\nworld\n',
+                     b'\x1f\x8b\x08\x00 not gzip\nworld\n'):
+            lines = sorted(data.splitlines(keepends=True))
+            path = self.path('input', [data])
+            for args, stdin in (([], data), ([path], None),
+                                (['-n', '5', path], None)):
+                result = run_shuf(*args, stdin=stdin)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertEqual(output_lines(result), lines)
+
+    def test_sidecar_reuse(self):
+        '''An unchanged file is not scanned again.'''
+        path = self.path('input', numbered(1000))
+        maps, keys = shuf.map_files([path], True)
+        self.assertTrue(os.path.exists(path + shuf.SIDECAR_SUFFIX))
+        with mock.patch.object(shuf, 'index_lines',
+                               side_effect=AssertionError('rescanned')):
+            self.assertEqual(shuf.map_files([path], True)[1], keys)
+
+    def test_sidecar_append(self):
+        '''After an append only the new lines are scanned.'''
+        path = self.path('input', numbered(1000))
+        shuf.map_files([path], True)
+        with open(path, 'ab') as f:
+            f.writelines(numbered(10, b'new'))
+        scan = shuf.index_lines
+        with mock.patch.object(shuf, 'index_lines',
+                               side_effect=scan) as index_lines:
+            maps, keys = shuf.map_files([path], True)
+        self.assertGreater(index_lines.call_args.args[1], 0)
+        self.assertEqual(keys, scan(maps[0]))
+
+    def test_sidecar_invalidation(self):
+        '''An edit before an append is noticed, even with the size kept.'''
+        lines = numbered(10000)
+        path = self.path('input', lines)
+        shuf.map_files([path], True)
+        with open(path, 'rb') as f:
+            data = f.read()
+        data = data.replace(b'\n500\n501\n', b'\n5\n50001\n', 1) + b'end\n'
+        with open(path, 'wb') as f:
+            f.write(data)
+        maps, keys = shuf.map_files([path], True)
+        self.assertEqual(keys, shuf.index_lines(maps[0]))
+        result = run_shuf('--index-cache', path)
+        self.assertEqual(output_lines(result),
+                         sorted(data.splitlines(keepends=True)))
+
+    def test_sidecar_append_while_indexing(self):
+        '''A sidecar written as the file grows describes what was mapped.'''
+        path = self.path('input', numbered(1000))
+        mm, st = shuf.open_mapping(path)
+        with open(path, 'ab') as f:
+            f.writelines(numbered(10, b'new'))
+        # What the descriptor's stat reads once the append lands
+        st = os.stat(path)
+        self.assertEqual(shuf.sidecar_index(path, mm, st),
+                         shuf.index_lines(mm))
+        mm.close()
+        maps, keys = shuf.map_files([path], True)
+        self.assertEqual(keys, shuf.index_lines(maps[0]))
+
+    def test_sidecar_head_count(self):
+        '''--index-cache -n samples from the sidecar index.'''
+        lines = numbered(1000)
+        path = self.path('input', lines)
+        result = run_shuf('--index-cache', '--stats', '-n', '5', path)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(os.path.exists(path + shuf.SIDECAR_SUFFIX))
+        self.assertEqual(json.loads(result.stderr)['strategy'], 'mmap')
+        self.assertEqual(len(set(output_lines(result))), 5)
+        result = run_shuf('--index-cache', '-n', '5',
+                          stdin=b''.join(lines))
+        self.assertEqual(len(set(output_lines(result))), 5, result.stderr)
+
+    def test_group_index(self):
+        '''Lines are listed group by group, in input order within each.'''
+        lines = [b'a 1\n', b'b 2\n', b'a 3\n', b'c 4\n', b'b 5\n', b'a 6\n']
+        starts, order = shuf.group_index(lines, 1, None)
+        groups = [[lines[i] for i in order[starts[g]:starts[g + 1]]]
+                  for g in range(len(starts) - 1)]
+        self.assertEqual(groups, [[b'a 1\n', b'a 3\n', b'a 6\n'],
+                                  [b'b 2\n', b'b 5\n'], [b'c 4\n']])
+        output = list(shuf.grouped_shuffle(lines, 1, None, None,
+                                           random.Random(4)))
+        keys = [line.split()[0] for line in output]
+        self.assertEqual(sorted(output), sorted(lines))
+        # Each key appears in one run
+        self.assertEqual(len([k for i, k in enumerate(keys)
+                              if i == 0 or keys[i - 1] != k]), 3)
+
+    def test_stratify_quotas(self):
+        '''Each key contributes min(quota, its line count) lines.'''
+        lines = [b'%s,%d\n' % (key, i) for key, count in
+                 ((b'x', 50), (b'y', 3), (b'z', 7)) for i in range(count)]
+        sample = shuf.stratified_sample(lines, 1, b',', 5, random.Random(5))
+        counts = Counter(line.split(b',')[0] for line in sample)
+        self.assertEqual(counts, {b'x': 5, b'y': 3, b'z': 5})
+        self.assertEqual(len(set(sample)), len(sample))
+        self.assertTrue(set(sample) <= set(lines))
+
+    def test_line_arena(self):
+        '''A LineArena reads back the lines packed into it.'''
+        lines = numbered(100) + [b'\n', b'last\n']
+        arena = shuf.LineArena(lines[:50])
+        arena.extend(lines[50:-1])
+        arena.append(lines[-1])
+        self.assertEqual(len(arena), len(lines))
+        self.assertEqual(list(arena), lines)
+        self.assertEqual([arena[i] for i in (0, 50, 101)],
+                         [lines[0], lines[50], lines[101]])
+        self.assertEqual(arena.nbytes, sum(map(len, lines)))
+        packed = shuf.LineArena.from_bytes(b''.join(lines))
+        self.assertEqual(list(packed), lines)
+        order = shuf.line_order(len(arena))
+        random.Random(9).shuffle(order)
+        self.assertEqual(sorted(arena[i] for i in order), sorted(lines))
+
+    def test_output_onto_input(self):
+        '''-o can write the shuffle over its own input.'''
+        lines = numbered(20000)
+        path = self.path('input', lines)
+        result = run_shuf('-o', path, path)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with open(path, 'rb') as f:
+            output = f.read().splitlines(keepends=True)
+        self.assertEqual(sorted(output), sorted(lines))
+        self.assertEqual(os.listdir(self.tmp.name), ['input'])
+
+if __name__ == '__main__':
+    unittest.main()
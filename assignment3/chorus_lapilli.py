@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''Headless rules engine for Chorus Lapilli.
+
+This mirrors handleClick() in chorus-lapilli/src/App.js click for click,
+so any sequence of clicks can be checked here without a browser. A board
+is a pair of 9-bit masks, bit i being square i (0-8, row by row), and a
+State adds whose turn it is and the square selected in the movement
+phase.
+
+Example:
+    >>> import chorus_lapilli as cl
+    >>> state = cl.play(cl.START, [0, 3, 1, 4, 2])
+    >>> cl.status(state)
+    'Winner: X'
+'''
+import random
+import sys
+import time
+from collections import namedtuple
+
+X = 0
+O = 1
+SYMBOLS = 'XO'
+
+# Squares adjacent to each square, as in isAdjacent()
+ADJACENT_SQUARES = (
+    (1, 3, 4),
+    (0, 2, 3, 4, 5),
+    (1, 4, 5),
+    (0, 1, 4, 6, 7),
+    (0, 1, 2, 3, 5, 6, 7, 8),
+    (1, 2, 4, 7, 8),
+    (3, 4, 7),
+    (3, 4, 5, 6, 8),
+    (4, 5, 7),
+)
+ADJACENT = tuple(sum(1 << j for j in squares) for squares in ADJACENT_SQUARES)
+
+# Winning lines, in the order calculateWinner() and canWin() check them
+LINES = (
+    (0, 1, 2),
+    (3, 4, 5),
+    (6, 7, 8),
+    (0, 3, 6),
+    (1, 4, 7),
+    (2, 5, 8),
+    (0, 4, 8),
+    (2, 4, 6),
+)
+LINE_MASKS = tuple(sum(1 << i for i in line) for line in LINES)
+
+CENTER = 4
+PIECES = 3
+
+# x and o are bitboards; turn is X or O; selected is a square or None
+State = namedtuple('State', 'x o turn selected')
+
+START = State(0, 0, X, None)
+
+# is_win[mask] is True if mask covers a whole line
+is_win = bytes(any(mask & line == line for line in LINE_MASKS)
+               for mask in range(1 << 9))
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+def pieces(state, player):
+    '''Return the bitboard of player's pieces.'''
+    return state.o if player else state.x
+
+def winner(state):
+    '''Return X or O if that player has three in a row, else None.
+
+    As in calculateWinner(), lines are checked in order, but since a move
+    only ever completes a line for the player making it, at most one
+    player can have a line in a reachable position.
+    '''
+    for line in LINE_MASKS:
+        if state.x & line == line:
+            return X
+        if state.o & line == line:
+            return O
+    return None
+
+def is_placement(state):
+    '''Return True while the player to move has pieces left to place.'''
+    return popcount(pieces(state, state.turn)) < PIECES
+
+def can_win(state, player):
+    '''Mirror of canWin(): return the empty square that would complete a
+    line for player, or None.
+
+    Arguments:
+        state: State - the position to look at
+        player: int - X or O
+    Returns:
+        int or None - the square, taken from the first such line
+    '''
+    own = pieces(state, player)
+    empty = ~(state.x | state.o)
+    for line, mask in zip(LINES, LINE_MASKS):
+        if popcount(own & mask) == 2:
+            for i in line:
+                if empty >> i & 1:
+                    return i
+    return None
+
+def may_select(state, i):
+    '''Return True if the first click of a move may select square i.
+
+    With a piece in the center, App.js only lets a piece be picked up if
+    some adjacent empty square wins, or if it is the center piece. Its
+    scan reuses one scratch board for every target without resetting it,
+    so pieces pile up on the targets tried so far; this is mirrored here,
+    since it decides what the page really does.
+    '''
+    own = pieces(state, state.turn)
+    if not own >> i & 1:
+        return False
+    if not own >> CENTER & 1:
+        return True
+    scratch = own & ~(1 << i)
+    occupied = state.x | state.o
+    for target in ADJACENT_SQUARES[i]:
+        if not (occupied | scratch) >> target & 1:
+            scratch |= 1 << target
+            if is_win[scratch]:
+                return True
+    return i == CENTER
+
+def may_move(state, to):
+    '''Return True if the second click of a move may move the selected
+    piece to square to.'''
+    frm = state.selected
+    if (state.x | state.o) >> to & 1 or not ADJACENT[frm] >> to & 1:
+        return False
+    own = pieces(state, state.turn)
+    if own >> CENTER & 1 and frm != CENTER:
+        # Another piece may only leave while the center is held if it wins
+        return bool(is_win[own & ~(1 << frm) | 1 << to])
+    return True
+
+def click(state, i):
+    '''Return the state after clicking square i.
+
+    Clicks the page ignores return state itself, so
+    click(state, i) is state tells whether a click had any effect.
+
+    Arguments:
+        state: State - the position before the click
+        i: int - the square clicked, 0-8
+    Returns:
+        State - the position after the click
+    '''
+    if winner(state) is not None:
+        return state
+    turn = state.turn
+    if is_placement(state):
+        if (state.x | state.o) >> i & 1:
+            return state
+        return put(state, turn, 1 << i)
+    if state.selected is None:
+        if not may_select(state, i):
+            return state
+        return state._replace(selected=i)
+    if not may_move(state, i):
+        return state
+    return put(state, turn, 1 << i | 1 << state.selected)
+
+def put(state, player, flip):
+    # Toggle the squares in flip for player and pass the turn
+    if player == X:
+        return State(state.x ^ flip, state.o, O, None)
+    return State(state.x, state.o ^ flip, X, None)
+
+def play(state, clicks):
+    '''Return the state after clicking each square in clicks in turn.'''
+    for i in clicks:
+        state = click(state, i)
+    return state
+
+def moves(state):
+    '''Return the moves the player to move can complete from state.
+
+    A placement is (None, square) and a movement is (from, to), the two
+    clicks that make it. A state with a piece selected only offers moves
+    of that piece, because the page has no way to deselect it.
+
+    Returns:
+        List[Tuple[int or None, int]] - the moves, in square order
+    '''
+    if winner(state) is not None:
+        return []
+    if is_placement(state):
+        occupied = state.x | state.o
+        return [(None, i) for i in range(9) if not occupied >> i & 1]
+    if state.selected is not None:
+        starts = [state.selected]
+    else:
+        starts = [i for i in range(9) if may_select(state, i)]
+    result = []
+    for frm in starts:
+        selected = state._replace(selected=frm)
+        result.extend((frm, to) for to in ADJACENT_SQUARES[frm]
+                      if may_move(selected, to))
+    return result
+
+def make_move(state, move):
+    '''Return the state after move, a pair from moves().'''
+    frm, to = move
+    if frm is not None and state.selected is None:
+        state = click(state, frm)
+    return click(state, to)
+
+def reachable(start=START):
+    '''Return every state reachable from start by clicking squares.
+
+    Returns:
+        Dict[State, List[State]] - each state mapped to the distinct
+        states its clicks lead to (ignored clicks left out)
+    '''
+    graph = {}
+    frontier = [start]
+    while frontier:
+        state = frontier.pop()
+        if state in graph:
+            continue
+        successors = []
+        for i in range(9):
+            after = click(state, i)
+            if after is not state and after not in successors:
+                successors.append(after)
+                if after not in graph:
+                    frontier.append(after)
+        graph[state] = successors
+    return graph
+
+def board(state):
+    '''Return the text of the 9 tiles, '' for an empty square.'''
+    return [SYMBOLS[0] if state.x >> i & 1
+            else SYMBOLS[1] if state.o >> i & 1
+            else '' for i in range(9)]
+
+def status(state):
+    '''Return the text App.js shows in its .status element.'''
+    won = winner(state)
+    if won is not None:
+        return 'Winner: ' + SYMBOLS[won]
+    if is_placement(state):
+        return 'Next player: ' + SYMBOLS[state.turn]
+    return 'Next player: ' + SYMBOLS[state.turn] + ' (move a piece)'
+
+def random_playout(rng, length, state=START):
+    '''Yield (square, board, status) for a random sequence of clicks.
+
+    Most clicks are picked among those that change the state; one in four
+    is any square, so ignored clicks get exercised as well. The playout
+    stops early once no click changes anything (a win, or a selected
+    piece that cannot move).
+
+    Arguments:
+        rng: random.Random - source of the choices
+        length: int - the most clicks to make
+        state: State - where to start
+    '''
+    for _ in range(length):
+        effective = [i for i in range(9) if click(state, i) is not state]
+        if not effective:
+            return
+        if rng.random() < 0.25:
+            i = rng.randrange(9)
+        else:
+            i = rng.choice(effective)
+        state = click(state, i)
+        yield i, board(state), status(state)
+
+def main():
+    start = time.perf_counter()
+    graph = reachable()
+    elapsed = time.perf_counter() - start
+    won = sum(winner(state) is not None for state in graph)
+    stuck = sum(not successors and winner(state) is None
+                for state, successors in graph.items())
+    print(f'{len(graph)} reachable states ({won} won, {stuck} stuck) '
+          f'in {elapsed:.3f}s')
+    # Show one sample playout, seeded from the command line if given
+    rng = random.Random(sys.argv[1] if len(sys.argv) > 1 else None)
+    for i, tiles, message in random_playout(rng, 20):
+        print(i, ''.join(tile or '.' for tile in tiles), message)
+
+if __name__ == '__main__':
+    main()
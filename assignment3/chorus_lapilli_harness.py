@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+'''Parallel runner for the Chorus Lapilli Selenium tests.
+
+The app server is started once and shared. The test methods of
+TestChorusLapilli are dealt round-robin to N worker processes, and each
+worker drives its own (by default headless) browser. Worker results are
+merged back into a single unittest report.
+
+Usage:
+    python3 chorus_lapilli_harness.py -c chorus-lapilli -j 4
+    python3 chorus_lapilli_harness.py -c chorus-lapilli --prebuilt
+
+With --prebuilt, the app is built once with react-scripts build, and the
+build is cached under ~/.cache/chorus-lapilli by a hash of its sources.
+It is then served from a static HTTP server inside this process on a free
+port, which skips the dev server and starts in about a second.
+
+Workers find the server and browser through environment variables, which
+TestChorusLapilli reads when run on its own as well:
+    CHORUS_LAPILLI_URL       address of the app (http://localhost:3000)
+    CHORUS_LAPILLI_BROWSER   firefox, chrome or safari (chrome)
+    CHORUS_LAPILLI_HEADLESS  1 to run the browser without a window
+'''
+import os
+import sys
+import time
+import shutil
+import socket
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+import threading
+import subprocess
+import unittest
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ENV_URL = 'CHORUS_LAPILLI_URL'
+ENV_BROWSER = 'CHORUS_LAPILLI_BROWSER'
+ENV_HEADLESS = 'CHORUS_LAPILLI_HEADLESS'
+
+DEFAULT_URL = 'http://localhost:3000'
+DEFAULT_BROWSER = 'chrome'
+
+# Module and class holding the tests to shard
+TEST_MODULE = 'test_chorus_lapilli'
+TEST_CLASS = 'TestChorusLapilli'
+
+# Seconds to wait for the dev server, and between readiness checks
+SERVER_TIMEOUT = 120
+POLL_INTERVAL = 0.2
+
+# Where production builds are kept, and the app files a build depends on
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME')
+                         or os.path.expanduser('~/.cache'), 'chorus-lapilli')
+BUILD_INPUTS = ('src', 'public', 'package.json', 'package-lock.json')
+
+def app_url():
+    '''Return the address of the app under test.'''
+    return os.environ.get(ENV_URL, DEFAULT_URL)
+
+def new_driver(browser=None, headless=None):
+    '''Start a Selenium webdriver.
+
+    Arguments:
+        browser: str - 'firefox', 'chrome' or 'safari' (default: from
+            CHORUS_LAPILLI_BROWSER, else chrome)
+        headless: bool - run without a window (default: from
+            CHORUS_LAPILLI_HEADLESS); Safari can't, and ignores it
+    Returns:
+        WebDriver - the new driver
+    '''
+    from selenium import webdriver
+    if browser is None:
+        browser = os.environ.get(ENV_BROWSER, DEFAULT_BROWSER)
+    if headless is None:
+        headless = os.environ.get(ENV_HEADLESS) == '1'
+    if browser == 'firefox':
+        options = webdriver.FirefoxOptions()
+        if headless:
+            options.add_argument('-headless')
+        return webdriver.Firefox(options=options)
+    if browser == 'chrome':
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument('--headless=new')
+        return webdriver.Chrome(options=options)
+    if browser == 'safari':
+        return webdriver.Safari()
+    raise ValueError(f'unknown browser: {browser}')
+
+def is_serving(url):
+    '''Return True if url answers an HTTP request.'''
+    try:
+        with urllib.request.urlopen(url, timeout=1):
+            return True
+    except OSError:
+        return False
+
+def is_listening(url):
+    '''Return True if something accepts connections at url's port.'''
+    parts = urllib.parse.urlsplit(url)
+    try:
+        with socket.create_connection((parts.hostname, parts.port or 80),
+                                      timeout=1):
+            return True
+    except OSError:
+        return False
+
+def node_env(**extra):
+    # Environment for running react-scripts
+    env = dict(os.environ)
+    env.update({
+        # Prevent React from starting its own browser window
+        'BROWSER': 'none',
+        # Disable SSL warnings for Legacy NodeJS
+        'NODE_OPTIONS': '--openssl-legacy-provider',
+    })
+    env.update(extra)
+    return env
+
+def npm_install():
+    '''Install the app's dependencies if npm install has never run.'''
+    if not os.path.isfile('package-lock.json'):
+        subprocess.run(['npm', 'install'],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       env=node_env(),
+                       check=True)
+
+def start_dev_server(url, timeout=SERVER_TIMEOUT):
+    '''Start the React dev server for the app in the current directory.
+
+    Runs npm install first if it never ran, then waits until the server
+    accepts connections. The dev server holds requests until its first
+    compile is done, so that is enough for the browsers.
+
+    Returns:
+        subprocess.Popen - the server process, to terminate when done
+    Raises:
+        OSError - if the server exits or doesn't listen within timeout
+    '''
+    npm_install()
+    port = urllib.parse.urlsplit(url).port or 80
+    react = subprocess.Popen(['node',
+                              'node_modules/react-scripts/scripts/start.js'],
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,
+                             env=node_env(PORT=str(port)))
+    deadline = time.monotonic() + timeout
+    while not is_listening(url):
+        if react.poll() is not None:
+            raise OSError('React terminated before test')
+        if time.monotonic() > deadline:
+            react.terminate()
+            react.wait()
+            raise OSError(f'React did not answer at {url}')
+        time.sleep(POLL_INTERVAL)
+    return react
+
+def build_key(app_dir='.'):
+    '''Return a hash of the files the production build is made from.'''
+    digest = hashlib.sha256()
+    for name in BUILD_INPUTS:
+        path = os.path.join(app_dir, name)
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, file)
+                           for root, dirs, names in os.walk(path)
+                           if '__pycache__' not in root
+                           for file in names)
+        elif os.path.isfile(path):
+            files = [path]
+        else:
+            continue
+        for file in files:
+            digest.update(os.path.relpath(file, app_dir).encode() + b'\0')
+            with open(file, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+def cached_build(cache_dir=CACHE_DIR):
+    '''Return a directory holding the production build of the app in the
+    current directory, building it only if its sources changed.
+
+    Raises:
+        subprocess.CalledProcessError - if npm install or the build fails
+    '''
+    npm_install()
+    target = os.path.join(cache_dir, build_key())
+    if os.path.isfile(os.path.join(target, 'index.html')):
+        return target
+    os.makedirs(cache_dir, exist_ok=True)
+    # Build beside the cache entry and rename it into place, so a failed
+    # or concurrent build never leaves half a bundle under the key
+    temp = tempfile.mkdtemp(prefix='build.', dir=cache_dir)
+    try:
+        subprocess.run(['node', 'node_modules/react-scripts/scripts/build.js'],
+                       stdout=subprocess.DEVNULL,
+                       env=node_env(BUILD_PATH=temp, GENERATE_SOURCEMAP='false'),
+                       check=True)
+        try:
+            os.rename(temp, target)
+        except OSError:
+            # Another run got there first
+            if not os.path.isfile(os.path.join(target, 'index.html')):
+                raise
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+    return target
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    '''Static file handler that doesn't log every request.'''
+
+    def log_message(self, format, *args):
+        pass
+
+class StaticServer:
+    '''Serve a directory over HTTP from a thread of this process.
+
+    The socket is bound to a free port and listening as soon as the
+    object exists, so the server is ready without any polling.
+    '''
+
+    def __init__(self, directory, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer(
+            (host, port), partial(QuietHandler, directory=directory))
+        self.url = 'http://%s:%d' % self.httpd.server_address[:2]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class RemoteTest:
+    '''Stands in for a test that ran in a worker process.'''
+
+    def __init__(self, test_id, name, description):
+        self.test_id = test_id
+        self.name = name
+        self.description = description
+
+    def id(self):
+        return self.test_id
+
+    def shortDescription(self):
+        return self.description
+
+    def __str__(self):
+        return self.name
+
+class WorkerResult(unittest.TestResult):
+    '''Records outcomes as plain, picklable tuples.'''
+
+    def __init__(self):
+        super().__init__()
+        self.outcomes = []
+
+    def record(self, test, status, detail=''):
+        description = None
+        if isinstance(test, unittest.TestCase):
+            description = test.shortDescription()
+        self.outcomes.append((test.id(), str(test), description, status,
+                              detail))
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self.record(test, 'ok')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.record(test, 'fail', self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self.record(test, 'error', self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self.record(test, 'skip', reason)
+
+class MergedResult(unittest.TextTestResult):
+    '''Text result fed with worker outcomes instead of live tests.'''
+
+    def _exc_info_to_string(self, err, test):
+        # Workers send tracebacks already formatted
+        return err if isinstance(err, str) else super()._exc_info_to_string(
+            err, test)
+
+    def add_outcome(self, test_id, name, description, status, detail):
+        test = RemoteTest(test_id, name, description)
+        self.startTest(test)
+        if status == 'ok':
+            self.addSuccess(test)
+        elif status == 'fail':
+            self.addFailure(test, detail)
+        elif status == 'error':
+            self.addError(test, detail)
+        else:
+            self.addSkip(test, detail)
+        self.stopTest(test)
+
+def run_shard(names, env, module=TEST_MODULE, case=TEST_CLASS):
+    '''Worker: run the named test methods of module.case with env applied.
+
+    Returns:
+        List[Tuple[str, str, str, str, str]] - (test id, name,
+        description, status, traceback or skip reason) for each outcome
+    '''
+    os.environ.update(env)
+    case = getattr(__import__(module), case)
+    suite = unittest.TestSuite(case(name) for name in names)
+    result = WorkerResult()
+    suite.run(result)
+    return result.outcomes
+
+def select_names(case, patterns=None):
+    '''Return the test methods of case, filtered like unittest -k.
+
+    A pattern without a wildcard matches as a substring, so -k reset picks
+    test_reset_board; the patterns are matched against the full test id.
+    '''
+    loader = unittest.TestLoader()
+    if patterns:
+        loader.testNamePatterns = [pattern if '*' in pattern
+                                   else f'*{pattern}*'
+                                   for pattern in patterns]
+    return list(loader.getTestCaseNames(case))
+
+def shard_names(names, jobs):
+    '''Deal names round-robin into at most jobs non-empty shards.'''
+    return [names[i::jobs] for i in range(min(jobs, len(names)))]
+
+def run_parallel(names, jobs, env, stream=sys.stderr, verbosity=1,
+                 module=TEST_MODULE, case=TEST_CLASS):
+    '''Run the test methods names of module.case over jobs workers and
+    report them.
+
+    Returns:
+        MergedResult - the merged outcomes, already printed to stream
+    '''
+    runner = unittest.TextTestRunner(stream=stream, verbosity=verbosity,
+                                     resultclass=MergedResult)
+    result = runner._makeResult()
+    stream = result.stream
+    start = time.perf_counter()
+    # Spawned workers import the test module only after run_shard has set
+    # env, so nothing in it can see the values this process started with
+    with ProcessPoolExecutor(max_workers=jobs,
+                             mp_context=multiprocessing.get_context('spawn')
+                             ) as pool:
+        futures = [pool.submit(run_shard, shard, env, module, case)
+                   for shard in shard_names(names, jobs)]
+        for future in as_completed(futures):
+            try:
+                outcomes = future.result()
+            except Exception as err:
+                # The worker itself died; report it like a class error
+                outcomes = [(case, case, None, 'error',
+                             f'worker failed: {err!r}\n')]
+            for outcome in outcomes:
+                result.add_outcome(*outcome)
+    elapsed = time.perf_counter() - start
+    result.printErrors()
+    stream.writeln(result.separator2)
+    run = result.testsRun
+    stream.writeln(f'Ran {run} test{"s" if run != 1 else ""} '
+                   f'in {elapsed:.3f}s')
+    stream.writeln()
+    details = []
+    if result.failures:
+        details.append(f'failures={len(result.failures)}')
+    if result.errors:
+        details.append(f'errors={len(result.errors)}')
+    if result.skipped:
+        details.append(f'skipped={len(result.skipped)}')
+    if result.wasSuccessful():
+        stream.writeln('OK' + (f' ({", ".join(details)})' if details else ''))
+    else:
+        stream.writeln(f'FAILED ({", ".join(details)})')
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run the Chorus Lapilli tests in parallel browsers.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of browser workers (default: CPUs)')
+    parser.add_argument('-b', '--browser', default=DEFAULT_BROWSER,
+                        choices=['firefox', 'chrome', 'safari'],
+                        help='the browser to run tests with')
+    parser.add_argument('--no-headless', action='store_true',
+                        help='show the browser windows')
+    parser.add_argument('-c', '--change-dir', metavar='dir',
+                        help='the app directory (with package.json)')
+    parser.add_argument('-u', '--url', default=DEFAULT_URL,
+                        help='address to serve the app at')
+    parser.add_argument('--prebuilt', action='store_true',
+                        help='serve a cached production build on a free '
+                             'port instead of the dev server')
+    parser.add_argument('-k', dest='patterns', action='append',
+                        help='only run test methods matching the pattern')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list every test as it finishes')
+    args = parser.parse_args()
+    if args.jobs <= 0:
+        parser.error(f'invalid number of jobs: {args.jobs}')
+    return args
+
+def main():
+    args = parse_args()
+    # The test module lives beside this file, not in the app directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    if args.change_dir:
+        try:
+            os.chdir(args.change_dir)
+        except OSError as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
+    case = getattr(__import__(TEST_MODULE), TEST_CLASS)
+    names = select_names(case, args.patterns)
+    env = {
+        ENV_URL: args.url,
+        ENV_BROWSER: args.browser,
+        ENV_HEADLESS: '0' if args.no_headless else '1',
+    }
+
+    server = None
+    static = None
+    if args.prebuilt or not is_serving(args.url):
+        if not os.path.isfile('package.json'):
+            print('Invalid directory: cannot find \'package.json\'',
+                  file=sys.stderr)
+            sys.exit(1)
+        try:
+            if args.prebuilt:
+                static = StaticServer(cached_build())
+                env[ENV_URL] = static.url
+            else:
+                server = start_dev_server(args.url)
+        except (OSError, subprocess.CalledProcessError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+    try:
+        result = run_parallel(names, args.jobs, env,
+                              verbosity=2 if args.verbose else 1)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if static is not None:
+            static.close()
+    sys.exit(not result.wasSuccessful())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+'''Perfect-play oracle for Chorus Lapilli by retrograde analysis.
+
+Every position reachable from the empty board, through both the placement
+and the movement phase, gets a value for the player to move (WIN, LOSS
+or DRAW) and the number of moves to the end of the game with best play:
+the winner hurries, the loser holds out. The result is a packed table of
+one byte per board and turn, so a lookup is a single index.
+
+Example:
+    >>> import chorus_lapilli as cl, chorus_lapilli_solver as solver
+    >>> table = solver.solve()
+    >>> table.lookup(cl.play(cl.START, [0, 3, 1, 4]))
+    (1, 1)
+'''
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import chorus_lapilli as cl
+
+UNKNOWN = 0
+WIN = 1
+LOSS = 2
+DRAW = 3
+VALUE_NAMES = ('unknown', 'win', 'loss', 'draw')
+
+# An entry is value << DISTANCE_BITS | distance
+DISTANCE_BITS = 6
+DISTANCE_MASK = (1 << DISTANCE_BITS) - 1
+
+# Boards are numbered in base 3 (0 empty, 1 X, 2 O), times two for the turn
+SIZE = 3 ** 9 * 2
+TERNARY = tuple(sum(3 ** i for i in range(9) if mask >> i & 1)
+                for mask in range(1 << 9))
+
+MAGIC = b'CLTB\x01'
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'chorus_lapilli.table')
+
+def index(state):
+    '''Return the table index of state, ignoring any selected piece.'''
+    return (TERNARY[state.x] + 2 * TERNARY[state.o]) * 2 + state.turn
+
+class Table:
+    '''Solved values of every reachable Chorus Lapilli position.
+
+    Positions are looked up by index(), so finding a value is O(1). Use
+    solve() to compute a table, Table.load() to read a saved one.
+    '''
+
+    def __init__(self, data):
+        if len(data) != SIZE:
+            raise ValueError(f'table has {len(data)} entries, not {SIZE}')
+        self.data = data
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        '''Read a table written by save().
+
+        Raises:
+            ValueError - if path does not hold a table
+            OSError - if path can't be read
+        '''
+        with open(path, 'rb') as f:
+            blob = f.read()
+        if not blob.startswith(MAGIC):
+            raise ValueError(f'{path}: not a Chorus Lapilli table')
+        return cls(blob[len(MAGIC):])
+
+    def save(self, path=DEFAULT_PATH):
+        '''Write the table to path, replacing it atomically.'''
+        temp = f'{path}.{os.getpid()}'
+        with open(temp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(self.data)
+        os.replace(temp, path)
+
+    def lookup(self, state):
+        '''Return (value, distance) for the player to move in state.
+
+        A state with a piece selected can only go on with that piece, so
+        its value is worked out from those moves. Positions never reached
+        from the empty board are (UNKNOWN, 0).
+        '''
+        if state.selected is not None:
+            return self.resolve([self.lookup(cl.make_move(state, move))
+                                 for move in cl.moves(state)],
+                                cl.winner(state) is not None)
+        entry = self.data[index(state)]
+        return entry >> DISTANCE_BITS, entry & DISTANCE_MASK
+
+    @staticmethod
+    def resolve(children, won):
+        # Value of a position from its children's values, each seen from
+        # the opponent's side
+        if won:
+            return LOSS, 0
+        if not children:
+            return DRAW, 0
+        losses = [distance for value, distance in children if value == LOSS]
+        if losses:
+            return WIN, min(losses) + 1
+        if all(value == WIN for value, _ in children):
+            return LOSS, max(distance for _, distance in children) + 1
+        return DRAW, 0
+
+    def best_moves(self, state):
+        '''Return the moves from state that keep its value with best play.
+
+        Returns:
+            List[Tuple[int or None, int]] - moves as from cl.moves()
+        '''
+        value, distance = self.lookup(state)
+        best = []
+        for move in cl.moves(state):
+            child = self.lookup(cl.make_move(state, move))
+            if ((value == WIN and child == (LOSS, distance - 1))
+                    or (value == LOSS and child == (WIN, distance - 1))
+                    or (value == DRAW and child[0] == DRAW)):
+                best.append(move)
+        return best
+
+def positions(start=cl.START):
+    '''Return the move graph of every position reachable from start.
+
+    Returns:
+        Dict[State, List[State]] - each position mapped to the positions
+        its moves lead to
+    '''
+    graph = {}
+    frontier = [start]
+    while frontier:
+        state = frontier.pop()
+        if state in graph:
+            continue
+        children = [cl.make_move(state, move) for move in cl.moves(state)]
+        graph[state] = children
+        frontier.extend(child for child in children if child not in graph)
+    return graph
+
+def solve(start=cl.START):
+    '''Solve every position reachable from start by retrograde analysis.
+
+    Starting from the finished games, values are pushed back to parent
+    positions in order of distance: a parent with a losing child wins one
+    move later, and a parent whose children all win loses one move after
+    the slowest of them. Whatever is left unresolved is a draw.
+
+    Returns:
+        Table - the solved positions
+    '''
+    graph = positions(start)
+    parents = {state: [] for state in graph}
+    for state, children in graph.items():
+        for child in children:
+            parents[child].append(state)
+    unresolved = {state: len(children) for state, children in graph.items()}
+    data = bytearray(SIZE)
+    queue = deque()
+
+    def settle(state, value, distance):
+        if distance > DISTANCE_MASK:
+            raise OverflowError(f'distance {distance} does not fit the table')
+        data[index(state)] = value << DISTANCE_BITS | distance
+        queue.append((state, value, distance))
+
+    for state, children in graph.items():
+        if cl.winner(state) is not None:
+            # The player who just moved made the line
+            unresolved[state] = None
+            settle(state, LOSS, 0)
+        elif not children:
+            unresolved[state] = None
+            settle(state, DRAW, 0)
+    while queue:
+        state, value, distance = queue.popleft()
+        if value == DRAW:
+            continue
+        for parent in parents[state]:
+            if unresolved[parent] is None:
+                continue
+            if value == LOSS:
+                unresolved[parent] = None
+                settle(parent, WIN, distance + 1)
+            else:
+                unresolved[parent] -= 1
+                if unresolved[parent] == 0:
+                    unresolved[parent] = None
+                    settle(parent, LOSS, distance + 1)
+    for state, count in unresolved.items():
+        if count is not None:
+            data[index(state)] = DRAW << DISTANCE_BITS
+    return Table(bytes(data))
+
+def load_or_solve(path=DEFAULT_PATH):
+    '''Return the table saved at path, solving and saving it if needed.'''
+    try:
+        return Table.load(path)
+    except (OSError, ValueError):
+        table = solve()
+        try:
+            table.save(path)
+        except OSError:
+            pass
+        return table
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Solve Chorus Lapilli and save the oracle table.')
+    parser.add_argument('-o', '--output', default=DEFAULT_PATH,
+                        help='where to write the table')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    table = solve()
+    solved = time.perf_counter() - start
+    try:
+        table.save(args.output)
+    except OSError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    counts = [0] * len(VALUE_NAMES)
+    for entry in table.data:
+        counts[entry >> DISTANCE_BITS] += 1
+    value, distance = table.lookup(cl.START)
+    print(f'solved in {solved:.3f}s: '
+          + ', '.join(f'{count} {name}' for name, count
+                      in zip(VALUE_NAMES[1:], counts[1:])))
+    print(f'empty board: {VALUE_NAMES[value]} for X'
+          + (f' in {distance} moves' if value != DRAW else ''))
+
+if __name__ == '__main__':
+    main()
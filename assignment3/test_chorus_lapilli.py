@@ -10,12 +10,15 @@ import subprocess
 import unittest
 import urllib.request
 import time
+import random
+
+import chorus_lapilli
+import chorus_lapilli_harness
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium import webdriver
 from selenium.common.exceptions import WebDriverException
 
 class TestChorusLapilli(unittest.TestCase):
@@ -27,8 +30,9 @@ class TestChorusLapilli(unittest.TestCase):
 
     # ========================== [USEFUL CONSTANTS] ===========================
 
-    # React default startup address
-    REACT_HOST_ADDR = 'http://localhost:3000'
+    # React default startup address; setUpClass replaces it with
+    # CHORUS_LAPILLI_URL if that is set
+    REACT_HOST_ADDR = chorus_lapilli_harness.DEFAULT_URL
 
     # CSS selector used to find Chorus Lapilli board tiles
     BOARD_TILE_SELECTOR = '.square'
@@ -39,6 +43,50 @@ class TestChorusLapilli(unittest.TestCase):
     SYMBOL_X = 'X'
     SYMBOL_O = 'O'
 
+    # CSS selectors of the status message and the Reset Game button
+    STATUS_SELECTOR = '.status'
+    RESET_SELECTOR = '.reset-button'
+
+    # Random click sequences replayed from the rules engine, and their seed
+    PLAYOUTS = 50
+    PLAYOUT_CLICKS = 20
+    PLAYOUT_SEED = 35
+
+    # Run in the page by play_clicks(): click each tile in turn through the
+    # real React handlers and snapshot the board after every click. Each
+    # click is followed by a trip through the event loop, so React commits
+    # its update before the next click reads the board.
+    PLAY_SCRIPT = '''
+        const [tileSelector, statusSelector, clicks, done] = arguments;
+        const tick = () => new Promise(resolve => setTimeout(resolve, 0));
+        (async () => {
+            const steps = [];
+            for (const i of clicks) {
+                document.querySelectorAll(tileSelector)[i].click();
+                await tick();
+                steps.push([
+                    Array.from(document.querySelectorAll(tileSelector),
+                               tile => tile.textContent.trim()),
+                    document.querySelector(statusSelector).textContent.trim(),
+                ]);
+            }
+            done(steps);
+        })();
+    '''
+
+    # Run in the page by reset_board(): press Reset Game and report whether
+    # the button was there
+    RESET_SCRIPT = '''
+        const [resetSelector, done] = arguments;
+        const button = document.querySelector(resetSelector);
+        if (!button) {
+            done(false);
+            return;
+        }
+        button.click();
+        setTimeout(() => done(true), 0);
+    '''
+
     # ======================== [SETUP/TEARDOWN HOOKS] =========================
 
     @classmethod
@@ -50,14 +98,18 @@ class TestChorusLapilli(unittest.TestCase):
 
         # Configure the Selenium webdriver
         try:
-            cls.driver = webdriver.Chrome()  # Ensure chromedriver is in PATH
+            # Chrome unless CHORUS_LAPILLI_BROWSER says otherwise; ensure
+            # its driver is in PATH
+            cls.driver = chorus_lapilli_harness.new_driver()
             cls.driver.implicitly_wait(10)  # Wait up to 10 seconds for elements to appear
         except WebDriverException as e:
             print("Error initializing WebDriver.")
             print("Ensure you have the appropriate WebDriver installed and it's in your PATH.")
             raise e
 
-        # Navigate to the Chorus Lapilli app
+        # Navigate to the Chorus Lapilli app. The address is read here
+        # rather than at import, since harness workers set it afterwards
+        cls.REACT_HOST_ADDR = chorus_lapilli_harness.app_url()
         cls.driver.get(cls.REACT_HOST_ADDR)
 
     @classmethod
@@ -71,10 +123,9 @@ class TestChorusLapilli(unittest.TestCase):
     def setUp(self):
         '''This function runs before every test.
 
-        Refresh the browser so we get a new board.
+        Reset the game so we get a new board.
         '''
-        self.driver.refresh()
-        time.sleep(1)  # Wait for the page to load
+        self.reset_board()
 
     def tearDown(self):
         '''This function runs after every test.
@@ -130,6 +181,40 @@ class TestChorusLapilli(unittest.TestCase):
         status_element = self.driver.find_element(By.CLASS_NAME, 'status')
         return status_element.text.strip()
 
+    def reset_board(self):
+        '''Start a new game without reloading the page.
+
+        Presses Reset Game, which clears the board, turn and selection in
+        one round trip. Falls back to refreshing the page if the button
+        can't be found.
+        '''
+        if not self.driver.execute_async_script(self.RESET_SCRIPT,
+                                                self.RESET_SELECTOR):
+            self.driver.refresh()
+            time.sleep(1)  # Wait for the page to load
+
+    def play_clicks(self, clicks):
+        '''Click a sequence of tiles in a single WebDriver round trip.
+
+        Arguments:
+            clicks: List[int] - the tiles to click, 0-8, in order
+        Returns:
+            List[Tuple[List[str], str]]: The text of all 9 tiles and the
+            status message after each click.
+        '''
+        steps = self.driver.execute_async_script(
+            self.PLAY_SCRIPT, self.BOARD_TILE_SELECTOR, self.STATUS_SELECTOR,
+            list(clicks))
+        return [(tiles, status) for tiles, status in steps]
+
+    def get_board(self):
+        '''Retrieve the text of all board tiles.
+
+        Returns:
+            List[str]: The symbol on each of the 9 tiles, '' if empty.
+        '''
+        return [tile.text.strip() for tile in self.get_tiles()]
+
     # =========================== [ADD YOUR TESTS HERE] ===========================
 
     def test_empty_board_on_refresh(self):
@@ -251,6 +336,36 @@ class TestChorusLapilli(unittest.TestCase):
         self.assertTileIs(tiles[4], self.SYMBOL_BLANK)
         self.assertTileIs(tiles[7], self.SYMBOL_O)
 
+    def test_sampled_playouts(self):
+        '''Replay random click sequences and compare every step with the
+        rules engine in chorus_lapilli.py.'''
+        rng = random.Random(self.PLAYOUT_SEED)
+        for playout in range(self.PLAYOUTS):
+            if playout:
+                self.reset_board()
+            expected = list(chorus_lapilli.random_playout(
+                rng, self.PLAYOUT_CLICKS))
+            clicks = [i for i, _, _ in expected]
+            steps = self.play_clicks(clicks)
+            self.assertEqual(len(steps), len(clicks))
+            for n, ((_, board, status), (tiles, shown)) in enumerate(
+                    zip(expected, steps), 1):
+                self.assertEqual(tiles, board,
+                                 f'board differs after clicks {clicks[:n]}')
+                self.assertEqual(shown, status,
+                                 f'status differs after clicks {clicks[:n]}')
+
+    def test_reset_board(self):
+        '''Check that Reset Game clears the board, turn and selection.'''
+        # X and O place three each, then X selects the piece at 8
+        self.play_clicks([0, 4, 1, 7, 8, 6, 8])
+        self.reset_board()
+        self.assertEqual(self.get_board(), [self.SYMBOL_BLANK] * 9)
+        self.assertEqual(self.get_status_text(), 'Next player: X')
+        (tiles, status), = self.play_clicks([4])
+        self.assertEqual(tiles[4], self.SYMBOL_X)
+        self.assertEqual(status, 'Next player: O')
+
     # ================= [DO NOT MAKE ANY CHANGES BELOW THIS LINE] =================
 
 if __name__ != '__main__':
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+'''Tests of the parallel runner in chorus_lapilli_harness.
+
+No browser is needed: the workers run small stand-in test cases that
+check what TestChorusLapilli would see in their place.
+'''
+import io
+import os
+import tempfile
+import unittest
+import urllib.request
+
+import chorus_lapilli_harness as harness
+
+# The address the workers are given, and the module they import it from
+PROBE_URL = 'http://127.0.0.1:45678'
+MODULE = os.path.splitext(os.path.basename(__file__))[0]
+
+class UrlProbe(unittest.TestCase):
+    '''Stands in for TestChorusLapilli in a worker; not run on its own.'''
+
+    __test__ = False
+
+    # Read on import, the earliest the real test module could read it
+    url = harness.app_url()
+
+    def test_url(self):
+        self.assertEqual(self.url, PROBE_URL)
+
+class Names(unittest.TestCase):
+    '''Test methods for select_names(); not run on its own.'''
+
+    __test__ = False
+
+    def test_reset_board(self):
+        pass
+
+    def test_sampled_playouts(self):
+        pass
+
+    def test_place_piece(self):
+        pass
+
+class TestChorusLapilliHarness(unittest.TestCase):
+    '''The harness pieces that don't need a browser'''
+
+    def test_worker_sees_url(self):
+        '''Each worker reads the URL it was given, not this process's.'''
+        self.assertNotEqual(harness.app_url(), PROBE_URL)
+        stream = io.StringIO()
+        result = harness.run_parallel(['test_url', 'test_url'], 2,
+                                      {harness.ENV_URL: PROBE_URL},
+                                      stream=stream, module=MODULE,
+                                      case='UrlProbe')
+        self.assertEqual(result.testsRun, 2)
+        self.assertTrue(result.wasSuccessful(), stream.getvalue())
+
+    def test_select_names(self):
+        '''-k patterns match like unittest -k.'''
+        self.assertEqual(harness.select_names(Names),
+                         ['test_place_piece', 'test_reset_board',
+                          'test_sampled_playouts'])
+        self.assertEqual(harness.select_names(Names, ['reset']),
+                         ['test_reset_board'])
+        self.assertEqual(harness.select_names(Names,
+                                              ['*.test_p*', 'board']),
+                         ['test_place_piece', 'test_reset_board'])
+        self.assertEqual(harness.select_names(Names, ['nothing']), [])
+
+    def test_shard_names(self):
+        '''Shards are dealt round-robin and never empty.'''
+        names = [f'test_{i}' for i in range(5)]
+        self.assertEqual(harness.shard_names(names, 2),
+                         [names[0::2], names[1::2]])
+        self.assertEqual(harness.shard_names(names[:2], 4),
+                         [names[:1], names[1:2]])
+
+    def test_static_server(self):
+        '''StaticServer answers on its own port as soon as it exists.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'index.html'), 'w') as f:
+                f.write('<div id="root"></div>')
+            with harness.StaticServer(tmp) as server:
+                self.assertTrue(harness.is_serving(server.url))
+                with urllib.request.urlopen(server.url) as response:
+                    self.assertEqual(response.read(),
+                                     b'<div id="root"></div>')
+
+def load_tests(loader, tests, pattern):
+    # Leave the stand-in cases to the workers
+    return loader.loadTestsFromTestCase(TestChorusLapilliHarness)
+
+if __name__ == '__main__':
+    unittest.main()
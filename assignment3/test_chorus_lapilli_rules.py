@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''Exhaustive tests of the Chorus Lapilli rules engine.
+
+Every state reachable by clicking is enumerated once, and the rule
+invariants are checked against all of them. No browser is needed; the
+Selenium harness in test_chorus_lapilli.py replays sampled click
+sequences from the same engine against the real page.
+
+Timing checks are flaky on loaded or instrumented machines, so they only
+run with CHORUS_LAPILLI_TIMING=1.
+'''
+import os
+import time
+import unittest
+
+import chorus_lapilli as cl
+
+TIMING = os.environ.get('CHORUS_LAPILLI_TIMING') == '1'
+
+class TestChorusLapilliRules(unittest.TestCase):
+    '''Invariants of chorus_lapilli over the whole reachable state space'''
+
+    @classmethod
+    def setUpClass(cls):
+        start = time.perf_counter()
+        cls.graph = cl.reachable()
+        cls.elapsed = time.perf_counter() - start
+
+    def transitions(self):
+        '''Yield (state, square, next state) for every click that changes
+        a reachable state.'''
+        for state in self.graph:
+            for i in range(9):
+                after = cl.click(state, i)
+                if after is not state:
+                    yield state, i, after
+
+    def test_enumeration_starts_empty(self):
+        '''The enumeration includes the empty board it starts from.'''
+        self.assertIn(cl.START, self.graph)
+
+    @unittest.skipUnless(TIMING, 'set CHORUS_LAPILLI_TIMING=1 to check')
+    def test_enumeration_is_fast(self):
+        '''The whole state space is enumerated in well under a second.'''
+        self.assertLess(self.elapsed, 1.0)
+
+    def test_adjacency_mirrors_grid(self):
+        '''isAdjacent() is symmetric and means one king step on the grid.'''
+        for i in range(9):
+            for j in range(9):
+                expected = i != j and (abs(i // 3 - j // 3) <= 1
+                                       and abs(i % 3 - j % 3) <= 1)
+                self.assertEqual(bool(cl.ADJACENT[i] >> j & 1), expected,
+                                 f'{i} -> {j}')
+
+    def test_piece_counts(self):
+        '''Pieces never overlap, each side has at most three, and X is
+        never behind O or more than one piece ahead.'''
+        for state in self.graph:
+            nx, no = cl.popcount(state.x), cl.popcount(state.o)
+            self.assertEqual(state.x & state.o, 0)
+            self.assertLessEqual(nx, cl.PIECES)
+            self.assertIn(nx - no, (0, 1))
+            if no < cl.PIECES:
+                self.assertEqual(state.turn, cl.X if nx == no else cl.O)
+
+    def test_single_winner(self):
+        '''At most one side has a line, and a won game ignores clicks.'''
+        for state in self.graph:
+            won_x = any(state.x & line == line for line in cl.LINE_MASKS)
+            won_o = any(state.o & line == line for line in cl.LINE_MASKS)
+            self.assertFalse(won_x and won_o)
+            if won_x or won_o:
+                self.assertEqual(self.graph[state], [])
+                # The winner is the player who just moved
+                self.assertNotEqual(cl.winner(state), state.turn)
+
+    def test_placement_fills_empty_squares(self):
+        '''A placement puts one piece of the mover on an empty square.'''
+        for state, i, after in self.transitions():
+            if cl.is_placement(state):
+                self.assertFalse((state.x | state.o) >> i & 1)
+                self.assertEqual(cl.pieces(after, state.turn),
+                                 cl.pieces(state, state.turn) | 1 << i)
+                self.assertEqual(after.turn, 1 - state.turn)
+
+    def test_selection_only_picks_own_piece(self):
+        '''Only a piece of the player to move can be selected, and only
+        once all pieces are placed.'''
+        for state, i, after in self.transitions():
+            if after.selected is not None:
+                self.assertIsNone(state.selected)
+                self.assertEqual(after.selected, i)
+                self.assertFalse(cl.is_placement(state))
+                self.assertTrue(cl.pieces(state, state.turn) >> i & 1)
+
+    def test_moves_are_adjacent(self):
+        '''A movement takes one piece to an adjacent empty square.'''
+        for state, i, after in self.transitions():
+            if state.selected is None:
+                continue
+            frm = state.selected
+            self.assertTrue(cl.ADJACENT[frm] >> i & 1)
+            self.assertFalse((state.x | state.o) >> i & 1)
+            self.assertEqual(cl.pieces(after, state.turn),
+                             cl.pieces(state, state.turn)
+                             & ~(1 << frm) | 1 << i)
+            self.assertEqual(cl.pieces(after, 1 - state.turn),
+                             cl.pieces(state, 1 - state.turn))
+
+    def test_vacate_center_rule(self):
+        '''A player holding the center must vacate it or win.'''
+        for state, i, after in self.transitions():
+            if state.selected is None:
+                continue
+            center = 1 << cl.CENTER
+            if (cl.pieces(state, state.turn) & center
+                    and cl.pieces(after, state.turn) & center):
+                self.assertEqual(cl.winner(after), state.turn)
+
+    def test_moves_match_clicks(self):
+        '''moves() lists exactly the moves the clicks can complete.'''
+        for state in self.graph:
+            expected = set()
+            for first in self.graph[state]:
+                if first.turn != state.turn:
+                    expected.add(first)
+                    continue
+                # A selection: follow it to the completed moves
+                expected.update(after for after in self.graph[first]
+                                if after.turn != state.turn)
+            self.assertEqual({cl.make_move(state, move)
+                              for move in cl.moves(state)}, expected)
+
+    def test_can_win(self):
+        '''canWin() names a square that completes a line.'''
+        for state in self.graph:
+            for player in (cl.X, cl.O):
+                square = cl.can_win(state, player)
+                if square is None:
+                    continue
+                self.assertFalse((state.x | state.o) >> square & 1)
+                self.assertTrue(cl.is_win[cl.pieces(state, player)
+                                          | 1 << square])
+
+    def test_known_games(self):
+        '''Hand-played sequences end where the page ends up.'''
+        state = cl.play(cl.START, [0, 3, 1, 4, 2])
+        self.assertEqual(cl.status(state), 'Winner: X')
+        self.assertEqual(cl.play(state, [5]), state)
+        state = cl.play(cl.START, [0, 3, 1, 4, 2, 5])
+        self.assertEqual(cl.board(state), ['X', 'X', 'X', 'O', 'O', '',
+                                           '', '', ''])
+        state = cl.play(cl.START, [0, 4, 1, 7, 8, 6, 8, 5])
+        self.assertEqual(cl.status(state), 'Next player: O (move a piece)')
+        # O holds the center and can't win, so 6 may not move to 3
+        self.assertEqual(cl.play(state, [6, 3]), state)
+        state = cl.play(state, [4, 3])
+        self.assertEqual(cl.board(state), ['X', 'X', '', 'O', '', 'X',
+                                           'O', 'O', ''])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''Tests of the Chorus Lapilli perfect-play oracle.
+
+The solved table is checked against the game tree itself: every value
+must follow from the values of the position's children. The load time
+is only checked with CHORUS_LAPILLI_TIMING=1, since wall-clock checks are
+flaky on loaded or instrumented machines.
+'''
+import os
+import tempfile
+import time
+import unittest
+
+import chorus_lapilli as cl
+import chorus_lapilli_solver as solver
+
+TIMING = os.environ.get('CHORUS_LAPILLI_TIMING') == '1'
+
+class TestChorusLapilliSolver(unittest.TestCase):
+    '''Consistency of the retrograde analysis over all positions'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.graph = solver.positions()
+        cls.table = solver.solve()
+
+    def test_values_follow_from_children(self):
+        '''Each value is the minimax of its children's values.'''
+        for state, children in self.graph.items():
+            expected = solver.Table.resolve(
+                [self.table.lookup(child) for child in children],
+                cl.winner(state) is not None)
+            self.assertEqual(self.table.lookup(state), expected, state)
+
+    def test_finished_games(self):
+        '''A won position is lost for the player to move, at distance 0.'''
+        for state in self.graph:
+            if cl.winner(state) is not None:
+                self.assertEqual(self.table.lookup(state), (solver.LOSS, 0))
+
+    def test_every_position_is_solved(self):
+        '''Reachable positions have a value; the rest are UNKNOWN.'''
+        indexes = {solver.index(state) for state in self.graph}
+        self.assertEqual(len(indexes), len(self.graph))
+        for i, entry in enumerate(self.table.data):
+            value = entry >> solver.DISTANCE_BITS
+            self.assertEqual(value != solver.UNKNOWN, i in indexes, i)
+
+    def test_known_positions(self):
+        '''Hand-checked positions have the expected values.'''
+        self.assertEqual(self.table.lookup(cl.START), (solver.DRAW, 0))
+        # X completes the top row next move
+        state = cl.play(cl.START, [0, 3, 1, 4])
+        self.assertEqual(self.table.lookup(state), (solver.WIN, 1))
+        self.assertEqual(self.table.best_moves(state), [(None, 2)])
+        # O answered the corner with the far edge square, and once X
+        # takes 1 as well O is lost
+        state = cl.play(cl.START, [0, 5])
+        self.assertEqual(self.table.lookup(state), (solver.WIN, 7))
+        state = cl.play(state, [1])
+        self.assertEqual(self.table.lookup(state), (solver.LOSS, 6))
+
+    def test_selected_piece(self):
+        '''A selected piece is valued by the moves it still has.'''
+        for state in cl.reachable():
+            if state.selected is None:
+                continue
+            moves = cl.moves(state)
+            self.assertTrue(all(move[0] == state.selected for move in moves))
+            self.assertEqual(self.table.lookup(state),
+                             solver.Table.resolve(
+                                 [self.table.lookup(cl.make_move(state, m))
+                                  for m in moves], False))
+
+    def test_save_and_load(self):
+        '''A saved table loads back unchanged.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'chorus_lapilli.table')
+            self.table.save(path)
+            loaded = solver.Table.load(path)
+            self.assertEqual(loaded.data, self.table.data)
+            with open(path, 'r+b') as f:
+                f.write(b'XXXX')
+            with self.assertRaises(ValueError):
+                solver.Table.load(path)
+
+    @unittest.skipUnless(TIMING, 'set CHORUS_LAPILLI_TIMING=1 to check')
+    def test_load_is_fast(self):
+        '''A saved table loads in milliseconds.'''
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'chorus_lapilli.table')
+            self.table.save(path)
+            start = time.perf_counter()
+            solver.Table.load(path)
+            self.assertLess(time.perf_counter() - start, 0.05)
+
+if __name__ == '__main__':
+    unittest.main()